@@ -0,0 +1,279 @@
+#! /usr/bin/python3
+""" Compressed, content addressed store of backups, indexed by host alias, table, key and time """
+
+# standard imports
+import contextlib
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+# external imports
+import argparse
+
+class BackupStore(object):
+    """ BackupStore constructor """
+
+    # zstandard (if it's installed), imported the first time an object is read or written
+    zstandard = None
+    zstandard_imported = False
+
+    def __init__(self, directory, retention_days=None):
+        """
+        Keyword arguments:
+        directory -- directory to keep the store in, created if it doesn't exist
+        retention_days -- backups older than this are evicted whenever a backup is added
+        """
+        self.directory = os.path.expanduser(directory)
+        self.retention_days = retention_days
+        if not os.path.isdir(os.path.join(self.directory, 'objects')):
+            os.makedirs(os.path.join(self.directory, 'objects'), 0o700)
+        with self._connect() as index:
+            index.executescript("""
+                create table if not exists backups (
+                    id integer primary key,
+                    alias text not null,
+                    table_name text not null,
+                    column_name text not null,
+                    created text not null,
+                    rows integer not null,
+                    header text not null default ''
+                );
+                create index if not exists backups_alias_table on backups (alias, table_name, created);
+                create table if not exists backup_rows (
+                    backup_id integer not null references backups (id),
+                    position integer not null,
+                    key text,
+                    object text not null,
+                    primary key (backup_id, position)
+                );
+                create index if not exists backup_rows_key on backup_rows (key);
+                create index if not exists backup_rows_object on backup_rows (object);
+            """)
+            # stores created before dumps had headers
+            if 'header' not in [row[1] for row in index.execute('pragma table_info(backups)')]:
+                index.execute("alter table backups add column header text not null default ''")
+
+    #
+    # PRIVATE methods
+    #
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        yield a connection to the index, one per call as we may be used from any thread,
+        committing (or rolling back) and closing it afterwards
+        """
+        index = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=30)
+        try:
+            with index:
+                yield index
+        finally:
+            index.close()
+
+    def _get_object_path(self, digest):
+        """ return the path of the object with the given sha256 digest """
+        suffix = '.zst' if BackupStore._get_zstandard() is not None else '.gz'
+        return os.path.join(self.directory, 'objects', digest[:2], digest + suffix)
+
+    @classmethod
+    def _get_zstandard(cls):
+        """
+        return the zstandard module, or None if it isn't installed. It's only imported once the store
+        is read or written, so runs which never touch it don't pay for importing it
+        """
+        if not BackupStore.zstandard_imported:
+            try:
+                import zstandard # pylint: disable=locally-disabled,import-error,import-outside-toplevel
+            except ImportError:
+                zstandard = None
+            BackupStore.zstandard = zstandard
+            BackupStore.zstandard_imported = True
+        return BackupStore.zstandard
+
+    def _read_object(self, digest):
+        """ return the (decompressed) content of an object """
+        path = self._get_object_path(digest)
+        if not os.path.exists(path):
+            # written by a store using the other compression
+            path = path[:-4] + '.gz' if path.endswith('.zst') else path[:-3] + '.zst'
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        if path.endswith('.zst'):
+            return BackupStore._get_zstandard().ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _write_object(self, data):
+        """ store data (once) by its content hash, returning the hash """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._get_object_path(digest)
+        if os.path.exists(path):
+            return digest
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700, exist_ok=True)
+        zstandard = BackupStore._get_zstandard()
+        if zstandard is not None:
+            data = zstandard.ZstdCompressor().compress(data)
+        else:
+            data = gzip.compress(data)
+        # write and rename, so the store only ever contains complete objects. Another thread (or run)
+        # storing the same row at the same time writes its own temp file, and either rename wins
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+        return digest
+
+    #
+    # PUBLIC methods
+    #
+
+    def evict(self, retention_days):
+        """
+        remove backups older than retention_days, and any objects only they referenced,
+        returning the number of backups removed
+        """
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).isoformat()
+        with self._connect() as index:
+            old = [row[0] for row in index.execute('select id from backups where created < ?', (cutoff, ))]
+            candidates = set()
+            for backup_id in old:
+                candidates.update(row[0] for row in index.execute(
+                    'select object from backup_rows where backup_id = ?', (backup_id, )
+                ))
+                index.execute('delete from backup_rows where backup_id = ?', (backup_id, ))
+                index.execute('delete from backups where id = ?', (backup_id, ))
+            # objects are shared between backups, only remove those nothing references any more
+            orphans = [
+                digest for digest in candidates
+                if index.execute('select 1 from backup_rows where object = ? limit 1', (digest, )).fetchone() is None
+            ]
+        for digest in orphans:
+            path = self._get_object_path(digest)
+            for suffixed in (path[:path.rindex('.')] + '.zst', path[:path.rindex('.')] + '.gz'):
+                if os.path.exists(suffixed):
+                    os.remove(suffixed)
+        return len(old)
+
+    def export(self, backup_id, dump_file):
+        """
+        write a backup back out as a dump file (with manifest, see PDBC.validate_dump)
+        which can be loaded as normal, returning the path of the dump file
+        """
+        with self._connect() as index:
+            rows = index.execute(
+                'select key, object from backup_rows where backup_id = ? order by position',
+                (backup_id, )
+            ).fetchall()
+            backup = index.execute(
+                'select table_name, column_name, created, header from backups where id = ?', (backup_id, )
+            ).fetchone()
+        if backup is None:
+            raise KeyError('no such backup: {0}'.format(backup_id))
+        header = backup[3].encode('UTF-8')
+        sha256 = hashlib.sha256(header)
+        size = len(header)
+        with open(dump_file, 'wb') as handle:
+            handle.write(header)
+            for row in rows:
+                data = self._read_object(row[1])
+                # objects are named by their hash, so a corrupt one is caught here rather than restored
+                if hashlib.sha256(data).hexdigest() != row[1]:
+                    raise ValueError('backup {0}: object {1} is corrupt'.format(backup_id, row[1]))
+                sha256.update(data)
+                size += len(data)
+                handle.write(data)
+        with open(dump_file + '.manifest', 'w') as handle:
+            json.dump({
+                'table': backup[0],
+                'column': backup[1],
+                'rows': len(rows),
+                'bytes': size,
+                'sha256': sha256.hexdigest(),
+                'header': backup[3],
+                'keys': [row[0] for row in rows],
+                'created': backup[2]
+            }, handle)
+        return dump_file
+
+    def find(self, host_alias, table, key=None):
+        """
+        return backups of table on host_alias (which contain key, if given), newest first:
+            [{id, alias, table, column, created, rows}]
+        """
+        sql = 'select id, alias, table_name, column_name, created, rows from backups ' + \
+            'where alias = ? and table_name = ?'
+        params = [host_alias, table]
+        if key is not None:
+            sql += ' and id in (select backup_id from backup_rows where key = ?)'
+            params.append(str(key))
+        with self._connect() as index:
+            res = index.execute(sql + ' order by created desc', params).fetchall()
+        return [dict(zip(['id', 'alias', 'table', 'column', 'created', 'rows'], row)) for row in res]
+
+    def put(self, host_alias, dump_file):
+        """
+        add a dump file (see PDBC.dump) to the store, returning the id of the backup.
+        Each row is stored once by the hash of its content, however many backups it's in
+
+        Keyword arguments:
+        host_alias -- the configured alias of the host the dump is from
+        dump_file -- path to the dump file, its manifest must be alongside it
+        """
+        with open(dump_file + '.manifest') as handle:
+            manifest = json.load(handle)
+        header = manifest.get('header', '')
+        with open(dump_file, 'rb') as handle:
+            # every dump format has exactly one row per line, after the header (kept with the backup)
+            handle.read(len(header.encode('UTF-8')))
+            digests = [self._write_object(line) for line in handle]
+        with self._connect() as index:
+            cur = index.execute(
+                'insert into backups (alias, table_name, column_name, created, rows, header) ' +
+                'values (?, ?, ?, ?, ?, ?)',
+                (host_alias, manifest['table'], manifest['column'], manifest['created'], len(digests), header)
+            )
+            backup_id = cur.lastrowid
+            index.executemany(
+                'insert into backup_rows (backup_id, position, key, object) values (?, ?, ?, ?)',
+                [
+                    (backup_id, position, manifest['keys'][position], digest)
+                    for position, digest in enumerate(digests)
+                ]
+            )
+        if self.retention_days is not None:
+            self.evict(self.retention_days)
+        return backup_id
+
+#
+#   main execution path, for finding and exporting backups by hand
+#
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    PARSER.add_argument('directory', help='backup store directory ([backup_store] in config)')
+    SUBPARSERS = PARSER.add_subparsers(dest='command')
+    FIND = SUBPARSERS.add_parser('find', help='list backups of a table, newest first')
+    FIND.add_argument('alias', help='host alias the backups were taken on')
+    FIND.add_argument('table', help='table the backups were taken of')
+    FIND.add_argument('key', nargs='?', help='only list backups containing this key')
+    EXPORT = SUBPARSERS.add_parser('export', help='write a backup out as a dump file')
+    EXPORT.add_argument('backup_id', type=int, help='id of the backup')
+    EXPORT.add_argument('dump_file', help='path to write the dump file to')
+    EVICT = SUBPARSERS.add_parser('evict', help='remove old backups')
+    EVICT.add_argument('retention_days', type=int, help='remove backups older than this')
+    ARGS = PARSER.parse_args()
+    STORE = BackupStore(ARGS.directory)
+    if ARGS.command == 'find':
+        for BACKUP in STORE.find(ARGS.alias, ARGS.table, ARGS.key):
+            print('{id}\t{created}\t{alias}\t{table}\t{column}\t{rows} rows'.format(**BACKUP))
+    elif ARGS.command == 'export':
+        print(STORE.export(ARGS.backup_id, ARGS.dump_file))
+    elif ARGS.command == 'evict':
+        print('{0} backups evicted'.format(STORE.evict(ARGS.retention_days)))
+    else:
+        PARSER.print_help()
+        sys.exit(2)
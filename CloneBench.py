@@ -0,0 +1,291 @@
+#! /usr/bin/python3
+""" Benchmark the clone pipeline against seeded tables, writing timings of each phase to json """
+
+# standard imports
+import configparser
+import datetime
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+# external imports
+import argparse
+from CloneRow import CloneRow
+from PDBC import PDBC
+
+class CloneBench(object):
+    """ CloneBench constructor """
+
+    # the phases of the pipeline we time, by the CloneRow method implementing them
+    PHASES = [
+        ('connect', 'set_connections'),
+        ('get_rows', 'get_rows'),
+        ('check_encoding', '_check_encoding'),
+        ('insert_target', 'insert_target'),
+        ('find_deltas', 'find_deltas'),
+        ('unload_target', '_unload_target'),
+        ('update_target', 'update_target'),
+        ('restore_target', '_restore_target')
+    ]
+
+    def __init__(self):
+        self.args = None
+        self.config = None
+        self.servers = []
+        self.work_dir = tempfile.mkdtemp(prefix='clone-bench-')
+
+    #
+    # PRIVATE methods
+    #
+
+    def _connect(self, host_alias):
+        """ return a PDBC connection to a host alias, for seeding """
+        section = 'host.' + host_alias
+        pdbc = PDBC(self.config.get(section, 'driver'))
+        con_args = {
+            'host': self.config.get(section, 'hostname'),
+            'user': self.config.get(section, 'username'),
+            'port': self.config.getint(section, 'port'),
+            'db': self.config.get(section, 'database')
+        }
+        if self.config.get(section, 'password') is not None:
+            con_args['passwd'] = self.config.get(section, 'password')
+        pdbc.connect(con_args)
+        return pdbc
+
+    def _get_rows(self, prefix):
+        """ return the seed rows, with every value prefixed so source and target differ """
+        blob = os.urandom(self.args.blob_size)
+        return [
+            tuple(['key{0:08d}'.format(i)] +
+                  ['{0}{1}-{2}'.format(prefix, i, c) for c in range(self.args.width)] +
+                  [blob])
+            for i in range(self.args.rows)
+        ]
+
+    def _run(self, iteration):
+        """ run the clone pipeline once, returning the seconds spent in each phase """
+        keys = ['key{0:08d}'.format(i) for i in range(self.args.batch)]
+        dolly = CloneRow(CloneRow.copy_config(self.config))
+        dolly.parse_cla([
+            '--feeling_lucky', '--unload_dir', self.work_dir,
+            self.args.source, self.args.target, self.args.table, 'clone_key'
+        ] + keys)
+        timings = {}
+        for phase, method in CloneBench.PHASES:
+            setattr(dolly, method, self._time(timings, phase, getattr(dolly, method)))
+        started = time.perf_counter()
+        # as CloneRow.clone, minus the prompt and the exit
+        dolly.set_connections()
+        dolly.get_rows()
+        dolly.insert_target()
+        dolly.find_deltas()
+        dolly.show_schema_updates()
+        dolly.update_target()
+        dolly._wait_for_unload() # pylint: disable=locally-disabled,protected-access
+        timings['clone'] = time.perf_counter() - started
+        # restoring puts the target back as it was, ready for the next iteration
+        dolly._restore_target() # pylint: disable=locally-disabled,protected-access
+        timings['total'] = time.perf_counter() - started
+        dolly._housekeep() # pylint: disable=locally-disabled,protected-access
+        logging.warning('iteration %s: clone %.3fs, total %.3fs', iteration, timings['clone'], timings['total'])
+        return timings
+
+    def _seed(self, host_alias, prefix):
+        """ (re)create the benchmark table on a host alias and fill it """
+        pdbc = self._connect(host_alias)
+        postgres = self.config.get('host.' + host_alias, 'driver') == 'psql'
+        columns = ['clone_key'] + ['col{0}'.format(c) for c in range(self.args.width)] + ['payload']
+        ddl = 'create table {0} (id {1} primary key, clone_key varchar(32) not null unique, {2}, payload {3})'
+        quote = '"' if postgres else '`'
+        cur = pdbc.cursor()
+        cur.execute('drop table if exists {0}{1}{0}'.format(quote, self.args.table))
+        cur.execute(ddl.format(
+            '{0}{1}{0}'.format(quote, self.args.table),
+            'serial' if postgres else 'integer auto_increment',
+            ', '.join('col{0} varchar(64)'.format(c) for c in range(self.args.width)),
+            'bytea' if postgres else 'longblob'
+        ))
+        logging.warning('seeding %s rows into %s..', self.args.rows, host_alias)
+        pdbc.bulk_insert(self.args.table, columns, self._get_rows(prefix))
+        cur.close()
+        pdbc.commit()
+        info = {'driver': self.config.get('host.' + host_alias, 'driver'), 'version': pdbc.get_server_info()}
+        pdbc.close()
+        return info
+
+    def _start_mysql(self, port):
+        """ start a throwaway mysql server on port, returning its host alias config """
+        data_dir = os.path.join(self.work_dir, 'mysql')
+        subprocess.check_call(
+            ['mysqld', '--initialize-insecure', '--datadir=' + data_dir],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        # identifiers are double quoted throughout
+        server = subprocess.Popen([
+            'mysqld', '--datadir=' + data_dir, '--port={0}'.format(port), '--bind-address=127.0.0.1',
+            '--socket=' + os.path.join(self.work_dir, 'mysql.sock'), '--local-infile=1',
+            '--sql-mode=ANSI_QUOTES,STRICT_TRANS_TABLES'
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.servers.append(lambda: server.terminate() or server.wait())
+        return {'driver': 'mysql', 'username': 'root', 'password': None, 'port': str(port)}
+
+    def _start_postgres(self, port):
+        """ start a throwaway postgres server on port, returning its host alias config """
+        data_dir = os.path.join(self.work_dir, 'postgres')
+        subprocess.check_call(
+            ['initdb', '-D', data_dir, '-U', 'postgres', '--auth=trust'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        subprocess.check_call([
+            'pg_ctl', '-D', data_dir, '-w', '-l', os.path.join(self.work_dir, 'postgres.log'),
+            '-o', '-p {0} -k {1}'.format(port, self.work_dir), 'start'
+        ], stdout=subprocess.DEVNULL)
+        self.servers.append(lambda: subprocess.call(
+            ['pg_ctl', '-D', data_dir, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL
+        ))
+        return {'driver': 'psql', 'username': 'postgres', 'password': None, 'port': str(port)}
+
+    def _start_server(self):
+        """
+        start a throwaway server for --start, with a source and target database,
+        and add host aliases for them to the config
+        """
+        driver = self.args.start
+        port = self.args.port
+        logging.warning('starting a local %s server on port %s..', driver, port)
+        host = self._start_mysql(port) if driver == 'mysql' else self._start_postgres(port)
+        self.config = configparser.ConfigParser(allow_no_value=True)
+        for alias in ['bench_source', 'bench_target']:
+            self.config.read_dict({'host.' + alias: dict(host, hostname='127.0.0.1', database=alias)})
+        # wait for the server to take connections, then create the databases
+        deadline = time.time() + 60
+        while True:
+            try:
+                pdbc = PDBC(driver)
+                db = 'postgres' if driver == 'psql' else 'mysql'
+                pdbc.connect({'host': '127.0.0.1', 'user': host['username'], 'port': port, 'db': db})
+                break
+            except Exception: # pylint: disable=locally-disabled,broad-except
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+        pdbc.autocommit(True)
+        cur = pdbc.cursor()
+        for alias in ['bench_source', 'bench_target']:
+            cur.execute('create database ' + alias)
+        cur.close()
+        pdbc.close()
+        self.args.source = 'bench_source'
+        self.args.target = 'bench_target'
+
+    @classmethod
+    def _summarise(cls, values):
+        """ return min, median, mean and max of a list of timings """
+        return {
+            'min': min(values),
+            'median': statistics.median(values),
+            'mean': statistics.mean(values),
+            'max': max(values)
+        }
+
+    @classmethod
+    def _time(cls, timings, phase, method):
+        """ return method wrapped to add the seconds spent in each call of it to timings[phase] """
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timings[phase] = timings.get(phase, 0) + time.perf_counter() - started
+        return timed
+
+    #
+    # PUBLIC methods
+    #
+
+    def parse_cla(self):
+        """ parse command line arguments """
+        parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        parser.add_argument(
+            '--start', '-S',
+            choices=['mysql', 'psql'],
+            help='start a throwaway local server (mysqld or initdb and pg_ctl must be on the path) ' +
+            'instead of using host aliases from CloneRow.cfg',
+            default=None
+        )
+        parser.add_argument('--port', '-p', type=int, help='port for --start', default=54329)
+        parser.add_argument('--source', '-s', help='source host alias, unless --start', default=None)
+        parser.add_argument('--target', '-t', help='target host alias, unless --start', default=None)
+        parser.add_argument('--table', '-T', help='name of the table to seed', default='clone_bench')
+        parser.add_argument('--rows', '-r', type=int, help='rows to seed', default=10000)
+        parser.add_argument('--width', '-w', type=int, help='varchar columns per row', default=20)
+        parser.add_argument('--blob_size', '-B', type=int, help='bytes of blob per row', default=1024)
+        parser.add_argument(
+            '--batch', '-b', type=int, help='rows to clone per iteration, 1 is a single row clone', default=1
+        )
+        parser.add_argument('--iterations', '-i', type=int, help='times to run the pipeline', default=5)
+        parser.add_argument('--output', '-o', help='file to write json results to', default='clone-bench.json')
+        args = parser.parse_args()
+        if args.start is None and (args.source is None or args.target is None):
+            parser.error('--source and --target are required unless running with --start')
+        if args.batch > args.rows:
+            parser.error('--batch cannot be more than --rows')
+        self.args = args
+
+    def run(self):
+        """ seed, run every iteration and write the results """
+        try:
+            if self.args.start is not None:
+                self._start_server()
+            else:
+                self.config = CloneRow.read_config()
+            logging.getLogger().setLevel(logging.WARNING)
+            hosts = {
+                'source': self._seed(self.args.source, 'source'),
+                'target': self._seed(self.args.target, 'target')
+            }
+            runs = [self._run(i) for i in range(self.args.iterations)]
+        finally:
+            for stop in self.servers:
+                stop()
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        phases = [phase for phase, method in CloneBench.PHASES] + ['clone', 'total']
+        summary = dict(
+            (phase, CloneBench._summarise([run.get(phase, 0) for run in runs])) for phase in phases
+        )
+        results = {
+            'created': datetime.datetime.now().isoformat(),
+            'revision': self.get_revision(),
+            'params': vars(self.args),
+            'hosts': hosts,
+            'runs': runs,
+            'summary': summary,
+            'rows_per_second': self.args.batch / summary['clone']['median']
+        }
+        with open(self.args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+        for phase in phases:
+            logging.warning('%-15s median %.4fs', phase, summary[phase]['median'])
+        logging.warning('results written to %s', self.args.output)
+
+    @classmethod
+    def get_revision(cls):
+        """ return the git revision being benchmarked, if we can tell """
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)),
+                stderr=subprocess.DEVNULL
+            ).decode('UTF-8').strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+if __name__ == '__main__':
+    BENCH = CloneBench()
+    BENCH.parse_cla()
+    BENCH.run()
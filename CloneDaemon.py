@@ -0,0 +1,117 @@
+#! /usr/bin/python3
+""" Long running daemon taking clone jobs over a unix socket, reusing warm connections """
+
+# standard imports
+import json
+import logging
+import os
+import socketserver
+import stat
+
+# external imports
+import argparse
+from CloneRow import CloneRow
+from ConnectionPool import ConnectionPool
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """ handle newline delimited json clone jobs from a single client """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            result = self.server.clone_daemon.run_job(line)
+            self.wfile.write(json.dumps(result).encode('UTF-8') + b'\n')
+
+class CloneDaemon(object):
+    """ CloneDaemon constructor """
+
+    def __init__(self):
+        self.config = CloneRow.read_config()
+        self.pool = None
+        self.socket = None
+
+    #
+    # PUBLIC methods
+    #
+
+    def parse_cla(self):
+        """ parse command line arguments """
+        parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        parser.add_argument(
+            '--socket', '-S',
+            help='path of the unix socket to listen for jobs on',
+            default='/tmp/clone-row.sock'
+        )
+        parser.add_argument(
+            '--max_idle', '-m',
+            type=int,
+            help='maximum number of idle connections to keep per host alias',
+            default=4
+        )
+        args = parser.parse_args()
+        self.socket = args.socket
+        self.pool = ConnectionPool(args.max_idle)
+
+    def run_job(self, line):
+        """
+        run a single clone job, returning a dict describing the result
+
+        Keyword arguments:
+        line -- json encoded job, the args are exactly those taken by CloneRow.py, e.g.
+                {"args": ["example_one", "example_two", "my_table", "my_column", "my_filter"]}
+        """
+        try:
+            args = [str(arg) for arg in json.loads(line.decode('UTF-8'))['args']]
+        except (ValueError, KeyError, TypeError) as ex:
+            return {'code': 2, 'error': 'invalid job: {0}'.format(ex)}
+        # there's nobody at a terminal to answer the restore prompt
+        if '--feeling_lucky' not in args and '-f' not in args:
+            args.insert(0, '--feeling_lucky')
+        logging.info('running job: %s', ' '.join(args))
+        dolly = CloneRow(CloneRow.copy_config(self.config), self.pool)
+        code = 0
+        try:
+            dolly.parse_cla(args)
+            dolly.clone()
+        except SystemExit as ex:
+            code = ex.code
+        except Exception: # pylint: disable=locally-disabled,broad-except
+            logging.exception('job failed')
+            dolly._housekeep() # pylint: disable=locally-disabled,protected-access
+            code = 1
+        result = {'code': code, 'backup': dolly.target['backup'], 'backup_id': dolly.target['backup_id']}
+        if dolly.workers:
+            # cloned to several targets, each has its own backup
+            result['targets'] = dict(
+                (worker.target['alias'], {
+                    'backup': worker.target['backup'],
+                    'backup_id': worker.target['backup_id']
+                }) for worker in dolly.workers
+            )
+        if dolly.config.has_section('clone_row'):
+            result['dump_filepath'] = dolly.config.get('clone_row', 'dump_filepath')
+        return result
+
+    def serve(self):
+        """ listen for jobs until interrupted """
+        if os.path.exists(self.socket):
+            os.remove(self.socket)
+        server = socketserver.ThreadingUnixStreamServer(self.socket, JobHandler)
+        server.clone_daemon = self
+        # anyone who can write to the socket can clone to any configured host
+        os.chmod(self.socket, stat.S_IRUSR | stat.S_IWUSR)
+        logging.info('listening for jobs on %s', self.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info('shutting down..')
+        finally:
+            server.server_close()
+            self.pool.close()
+            os.remove(self.socket)
+
+if __name__ == '__main__':
+    DAEMON = CloneDaemon()
+    DAEMON.parse_cla()
+    DAEMON.serve()
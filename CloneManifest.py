@@ -0,0 +1,261 @@
+#! /usr/bin/python3
+""" Run a manifest of clone jobs, batching them by source, target and table """
+
+# standard imports
+import concurrent.futures
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# external imports
+import argparse
+from CloneRow import CloneRow
+from ConnectionPool import ConnectionPool
+
+class CloneManifest(object):
+    """ CloneManifest constructor """
+
+    def __init__(self):
+        self.config = CloneRow.read_config()
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.parallel = 4
+        self.pool = None
+        self.results = []
+        self.unload_dir = '/tmp'
+
+    #
+    # PRIVATE methods
+    #
+
+    def _error(self, message):
+        """ log an error about the manifest and exit """
+        logging.error(message)
+        sys.exit(2)
+
+    def _get_exit_code(self):
+        """ return the exit code every group agrees on, or 1 if any group failed, otherwise 0 """
+        codes = set(result['code'] for result in self.results)
+        if len(codes) == 1:
+            return codes.pop()
+        if codes - set([0, 5, 6]):
+            return 1
+        return 0
+
+    def _get_groups(self):
+        """
+        return the jobs grouped by source, target, table and column, each group's keys in manifest
+        order without duplicates. Groups are chained by target, so a target only takes one clone
+        at a time whichever source it's cloned from
+        """
+        groups = {}
+        for job in self.jobs:
+            group_key = (job['source'], job['target'], job['table'], job['column'])
+            group = groups.setdefault(group_key, {
+                'source': job['source'],
+                'target': job['target'],
+                'table': job['table'],
+                'column': job['column'],
+                'keys': []
+            })
+            group['keys'] += [key for key in job['keys'] if key not in group['keys']]
+        chains = {}
+        for group in groups.values():
+            chains.setdefault(group['target'], []).append(group)
+        return list(chains.values())
+
+    def _read_manifest(self, manifest_file):
+        """
+        read the jobs in a manifest, a list of objects with source, target, table, column and
+        either key or keys. Manifests can be json, yaml or csv (with a key column, one row per key)
+
+        Keyword arguments:
+        manifest_file -- path of the manifest, its format taken from the extension
+        """
+        extension = os.path.splitext(manifest_file)[1].lower()
+        try:
+            with open(manifest_file, newline='') as handle:
+                if extension == '.csv':
+                    jobs = list(csv.DictReader(handle))
+                elif extension in ('.yml', '.yaml'):
+                    try:
+                        import yaml
+                    except ImportError:
+                        self._error('yaml manifests need PyYAML installed, try a json or csv manifest')
+                    jobs = yaml.safe_load(handle)
+                else:
+                    jobs = json.load(handle)
+        except (IOError, ValueError) as ex:
+            self._error('could not read manifest {0}: {1}'.format(manifest_file, ex))
+        if not isinstance(jobs, list):
+            self._error('manifest {0} must be a list of jobs'.format(manifest_file))
+        aliases = [section[5:] for section in self.config.sections() if section.startswith('host.')]
+        for index, job in enumerate(jobs):
+            if not isinstance(job, dict):
+                self._error('manifest job {0} is not an object'.format(index))
+            missing = [field for field in ('source', 'target', 'table', 'column') if not job.get(field)]
+            if missing:
+                self._error('manifest job {0} is missing {1}'.format(index, ', '.join(missing)))
+            for alias in (job['source'], job['target']):
+                if alias not in aliases:
+                    self._error('manifest job {0}: unknown host alias {1}'.format(index, alias))
+            keys = job.get('keys', [job['key']] if job.get('key') not in (None, '') else [])
+            if not isinstance(keys, list) or not keys:
+                self._error('manifest job {0} has no key or keys'.format(index))
+            self.jobs.append({
+                'source': str(job['source']),
+                'target': str(job['target']),
+                'table': str(job['table']),
+                'column': str(job['column']),
+                'keys': [str(key) for key in keys]
+            })
+        if not self.jobs:
+            self._error('manifest {0} has no jobs'.format(manifest_file))
+
+    def _run_chain(self, chain):
+        """
+        run the groups cloning to a target one after another, stopping at the first failure
+
+        Keyword arguments:
+        chain -- the groups cloning to one target
+        """
+        for index, group in enumerate(chain):
+            result = self._run_group(group)
+            if result['code'] not in (0, 5, 6):
+                for skipped in chain[index + 1:]:
+                    logging.warning(
+                        'not running %s on %s -> %s, an earlier group failed',
+                        skipped['table'], skipped['source'], skipped['target']
+                    )
+                    self._save_result(skipped, {
+                        'code': None, 'backup': None, 'backup_id': None, 'dump_filepath': None, 'restore_sql': []
+                    })
+                return
+
+    def _run_group(self, group):
+        """
+        clone a group's keys in one batch, returning a dict describing the result
+
+        Keyword arguments:
+        group -- source, target, table, column and keys to clone
+        """
+        # dump files are only unique to the millisecond, and groups for the same table and column
+        # on other hosts may be running at the same time
+        unload_dir = os.path.join(self.unload_dir, '{0}-{1}'.format(group['source'], group['target']))
+        os.makedirs(unload_dir, exist_ok=True)
+        # there's nobody at a terminal to answer the restore prompt
+        args = [
+            '--feeling_lucky', '--unload_dir', unload_dir, '--',
+            group['source'], group['target'], group['table'], group['column']
+        ] + group['keys']
+        logging.info('running group: %s', ' '.join(args))
+        dolly = CloneRow(CloneRow.copy_config(self.config), self.pool)
+        code = 0
+        try:
+            dolly.parse_cla(args)
+            dolly.clone()
+        except SystemExit as ex:
+            code = ex.code
+        except Exception: # pylint: disable=locally-disabled,broad-except
+            logging.exception('group failed')
+            dolly._housekeep() # pylint: disable=locally-disabled,protected-access
+            code = 1
+        result = {
+            'code': code,
+            'backup': dolly.target['backup'],
+            'backup_id': dolly.target['backup_id'],
+            'dump_filepath': None,
+            'restore_sql': []
+        }
+        if dolly.config.has_section('clone_row'):
+            result['dump_filepath'] = dolly.config.get('clone_row', 'dump_filepath')
+        # only a clean run leaves a target worth rolling back, anything else was rolled back already
+        if code == 0:
+            result['restore_sql'] = [line.strip() for line in dolly.target['restore_sql']]
+        return self._save_result(group, result)
+
+    def _save_result(self, group, result):
+        """ record the result of a group, in the order groups finish """
+        result.update(group)
+        with self.lock:
+            self.results.append(result)
+        return result
+
+    def _write_plan(self):
+        """ log every group's outcome and the combined rollback, and write them to a plan file """
+        # undo the most recent clone first
+        restore_sql = []
+        for result in reversed(self.results):
+            restore_sql += result['restore_sql']
+        logging.info('')
+        logging.info('|Manifest Summary|')
+        for result in self.results:
+            logging.info(
+                '  %s -> %s %s.%s (%s keys): %s',
+                result['source'], result['target'], result['table'], result['column'],
+                len(result['keys']), 'not run' if result['code'] is None else 'exit ' + str(result['code'])
+            )
+        if restore_sql:
+            logging.info('')
+            logging.info('|Manual Rollback Steps|')
+            logging.info('  To rollback the whole manifest, run the following steps on this machine')
+            for line in restore_sql:
+                logging.warning('    %s', line)
+        plan_file = os.path.join(self.unload_dir, 'manifest-{0}.json'.format(int(round(time.time() * 1000))))
+        with open(plan_file, 'w') as handle:
+            json.dump({'groups': self.results, 'restore_sql': restore_sql}, handle, indent=2)
+        logging.info('')
+        logging.info('manifest plan written to %s', plan_file)
+
+    #
+    # PUBLIC methods
+    #
+
+    def parse_cla(self):
+        """ parse command line arguments """
+        parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        parser.add_argument(
+            '--parallel', '-p',
+            type=int,
+            help='maximum number of targets to clone to at once',
+            default=4
+        )
+        parser.add_argument(
+            '--unload_dir', '-u',
+            help='directory to unload backups, update sql dumps and the manifest plan to',
+            default='/tmp'
+        )
+        parser.add_argument('manifest', help='json, yaml or csv file of clone jobs')
+        args = parser.parse_args()
+        if args.parallel < 1:
+            parser.error('--parallel must be at least 1')
+        self.parallel = args.parallel
+        self.unload_dir = args.unload_dir
+        self._read_manifest(args.manifest)
+
+    def run(self):
+        """ run every group in the manifest, then exit with the combined exit code """
+        chains = self._get_groups()
+        logging.info(
+            'running %s jobs as %s groups over %s targets',
+            len(self.jobs), sum(len(chain) for chain in chains), len(chains)
+        )
+        # each target's chain holds at most one connection per host at a time, keep one idle per worker
+        self.pool = ConnectionPool(self.parallel)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                for future in [executor.submit(self._run_chain, chain) for chain in chains]:
+                    future.result()
+        finally:
+            self.pool.close()
+        self._write_plan()
+        sys.exit(self._get_exit_code())
+
+if __name__ == '__main__':
+    MANIFEST = CloneManifest()
+    MANIFEST.parse_cla()
+    MANIFEST.run()
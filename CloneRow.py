@@ -2,59 +2,113 @@
 """ Python module for cloning a row from one database to another """
 
 # standard imports
+import concurrent.futures
 import configparser
-import datetime
+import copy
+import fnmatch
 import logging
 import os
+import random
 import stat
 import sys
+import threading
 import time
 import traceback
 
+# taken before anything else is imported, the startup phase runs from here until we start cloning
+STARTED = time.perf_counter()
+
 # external imports
 import argparse
-import coloredlogs
-import paramiko
 from DictDiffer import DictDiffer
+from MetadataCache import MetadataCache
+from Metrics import Metrics
 from PDBC import PDBC
+from SqlTracer import SqlTracer
+from WatermarkStore import WatermarkStore
 
 class CloneRow(object):
     """ CloneRow constructor """
 
-    def __init__(self):
-        # make sure the config file has correct permissions (0600)
-        self._check_config_chmod()
-        coloredlogs.install(show_hostname=False, show_name=False, show_severity=False)
-        logging.info('Reading configuration..')
-        self.config = configparser.ConfigParser(allow_no_value=True)
-        try:
-            self.config.readfp(open(os.path.dirname(os.path.realpath(__file__)) + '/CloneRow.cfg'))
-        except IOError:
-            logging.error('You have not setup a CloneRow.cfg file for your requirements')
-            logging.info('take a look at CloneRow.example.cfg')
-            logging.info('https://github.com/lathonez/mysql-clone-row#configuration')
-            sys.exit(3)
+    def __init__(self, config=None, pool=None):
+        """
+        Keyword arguments:
+        config -- ConfigParser to use instead of reading CloneRow.cfg (see read_config)
+        pool -- ConnectionPool to take connections from and return them to, if any
+        """
+        self.config = config if config is not None else self.read_config()
+        self.pool = pool
+        # when cloning to several targets at once, each target gets a worker CloneRow
+        # sharing our source connection (see fan_out)
+        self.parent = None
+        self.workers = []
+        self.source_lock = threading.Lock()
+        self.log_shipper = None
+        # set up by parse_cla with --trace/--trace_file
+        self.tracer = None
+        # set up by parse_cla with --incremental
+        self.watermark_store = None
+        self.metadata_cache = None
+        if self.config.has_section('metadata_cache'):
+            self.metadata_cache = MetadataCache(self.config.get('metadata_cache', 'directory'))
+        self.metrics = Metrics(
+            self.config.get('metrics', 'jsonl_file', fallback=None),
+            self.config.get('metrics', 'textfile_dir', fallback=None)
+        )
+        self.backup_store = None
+        if self.config.has_section('backup_store'):
+            # sqlite and the compressors are only imported if backups are kept in a store
+            from BackupStore import BackupStore # pylint: disable=locally-disabled,import-outside-toplevel
+            retention_days = self.config.get('backup_store', 'retention_days', fallback=None)
+            self.backup_store = BackupStore(
+                self.config.get('backup_store', 'directory'),
+                int(retention_days) if retention_days else None
+            )
         self.source = {
             'alias': None,
             'connection': None,
             'db_name': None,
-            'row': {}
+            'hashed_columns': [],
+            'metadata': None,
+            'row': {},
+            'rows': {}
         }
         self.target = {
             'alias': None,
             'backup': None,
+            'backup_id': None,
+            'backup_keys': [],
+            'changed_keys': [],
             'connection': None,
             'db_name': None,
+            'hashed_columns': [],
+            'metadata': None,
             'new_insert': False,
-            'row': {}
+            'new_keys': [],
+            'restore_sql': [],
+            'row': {},
+            'rows': {},
+            'unload': None
         }
         self.database = {
             'table': None,
+            'table_glob': False,
             'column': None,
             'filter': None,
+            'batch': False,
+            'keys': None,
+            'range': None,
+            'table_sync': False,
+            'incremental': False,
+            'watermark_column': None,
+            'watermark': None,
             'ignore_columns': [],
-            'deltas': {}
+            'deltas': {},
+            'batch_deltas': {},
+            'dependencies': 0
         }
+        # source and target work is independent, so we do both at once where we can
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
 
     #
     # PRIVATE methods
@@ -77,6 +131,13 @@ class CloneRow(object):
         host_alias -- the configured alias of the host we're connecting to
                       e.g. local (defined as host.local in config)
         """
+        if self.pool is not None:
+            pdbc = self.pool.get(host_alias)
+            if pdbc is not None:
+                logging.info('reusing pooled connection to %s..', host_alias)
+                pdbc.trace(self.tracer, host_alias)
+                pdbc.itersize = self.config.getint('clone_row', 'itersize')
+                return pdbc
         logging.info('attempting to connect to %s..', host_alias)
         con_args = {}
         driver = self.config.get('host.' + host_alias, 'driver')
@@ -89,6 +150,14 @@ class CloneRow(object):
         exception = pdbc.get_exception_class('OperationalError')
         if password is not None:
             con_args['passwd'] = password
+        if self.config.getboolean('host.' + host_alias, 'local_infile', fallback=False):
+            # needed for bulk updates via LOAD DATA LOCAL INFILE on mysql
+            con_args['local_infile'] = 1
+        # fail fast rather than queue behind (and in front of) production traffic
+        for timeout in ['lock_timeout', 'statement_timeout']:
+            seconds = self.config.getfloat('host.' + host_alias, timeout, fallback=None)
+            if seconds:
+                con_args[timeout] = seconds
         try:
             pdbc.connect(con_args)
         except exception as sqlex:
@@ -103,24 +172,142 @@ class CloneRow(object):
             'connected to %s@%s:%s - Database version : %s',
             con_args['user'], host_alias, con_args['db'], pdbc.get_server_info()
         )
+        pdbc.trace(self.tracer, host_alias)
+        pdbc.itersize = self.config.getint('clone_row', 'itersize')
 
         return pdbc
 
+    def _check_source_rows(self):
+        """
+        make sure we've found something to clone in the source database. In batch mode,
+        warn about missing keys and narrow the batch down to the keys that were found
+        """
+        if not self.database['batch']:
+            if self.source['row'] is None:
+                self._error('get_rows: no row found in {0} database - query details (table , column, filter) {1} {2} {3}'.format(self.source['alias'], self.database['table'], self.database['column'], self.database['filter']))
+            return
+        if not self.source['rows']:
+            self._error('get_rows: no rows found in {0} database - query details (table, column) {1} {2}'.format(
+                self.source['alias'], self.database['table'], self.database['column']
+            ))
+        if self.database['keys'] is not None:
+            # keys from the command line are strings, whereas the rows are keyed on native types
+            found = set(str(key) for key in self.source['rows'])
+            missing = [key for key in self.database['keys'] if str(key) not in found]
+            if missing:
+                logging.warning(
+                    'the following keys were not found in %s and will be skipped: %s',
+                    self.source['alias'], ', '.join(str(key) for key in missing)
+                )
+        # from here on the batch is exactly the set of keys found in the source
+        self.database['keys'] = sorted(self.source['rows'].keys())
+
+    def _check_plans(self):
+        """
+        EXPLAIN the lookup of the row(s) on source and target before running it (updates,
+        deletes and dumps filter on the same column), refusing to go on without --force
+        if either would read more than --scan_threshold rows without an index
+        """
+        threshold = self.config.getint('clone_row', 'scan_threshold')
+        # with --schema_only there's no column to look rows up on
+        if not threshold or self.config.getboolean('clone_row', 'schema_only') or self.database['column'] is None:
+            return
+        # workers only look rows up on their own target, fan_out has no target of its own
+        hosts = [self.target] if self.parent is not None else [self.source, self.target]
+        hosts = [host for host in hosts if host['connection'] is not None]
+        plans = self._run_concurrently(*[(self._get_plan, host) for host in hosts])
+        for host, plan in zip(hosts, plans):
+            logging.info('%s plan: %s, ~%s rows', host['alias'], plan['access'], plan['rows'])
+            if not plan['full_scan'] or plan['rows'] <= threshold:
+                continue
+            message = 'check_plans: looking up {0} on {1} in {2} would read ~{3} rows ({4}), index {1}'.format(
+                self.database['table'], self.database['column'], host['alias'], plan['rows'], plan['access']
+            )
+            if not self.config.getboolean('clone_row', 'force'):
+                self._error(message + ' or run with --force')
+            logging.warning(message)
+
     def _check_encoding(self):
         """
         the encoding should match for source and target tables
         if it doesn't, error out and warn the user
         """
-        database = self.config.get('host.' + self.source['alias'], 'database')
         logging.info('checking encoding..')
-        source_enc = self.source['connection'].get_encoding(database, self.database['table'])
-        target_enc = self.target['connection'].get_encoding(database, self.database['table'])
+        source_meta, target_meta = self._run_concurrently(
+            (self._get_metadata, self.source), (self._get_metadata, self.target)
+        )
+        source_enc = source_meta['encoding']
+        target_enc = target_meta['encoding']
         logging.info('source encoding %s', source_enc)
         logging.info('target encoding %s', target_enc)
 
         if source_enc != target_enc:
             self._error('FATAL - encoding mismatch')
 
+    def _clone_target(self):
+        """
+        diff, back up and update a single target as a worker of fan_out (or a single table as a
+        worker of clone_dependencies), the source row(s) have already been read.
+        Returns the code we'd have exited with cloning to it alone
+        """
+        try:
+            if self.target['connection'] is None:
+                with self.metrics.phase('connect'):
+                    self.target['connection'] = self._connect(self.target['alias'])
+                    self.target['connection'].autocommit(False)
+            self._retry(self._clone_rows)
+            self._wait_for_unload()
+        except SystemExit as ex:
+            return ex.code
+        except Exception: # pylint: disable=locally-disabled,broad-except
+            logging.exception('cloning to %s failed', self.target['alias'])
+            self._housekeep()
+            return 1
+        return 0
+
+    def _clone_rows(self):
+        """
+        get, diff, back up and update the row(s) on the target, in one target transaction.
+        This is the unit retried on deadlocks, see _retry
+        """
+        # grab the row(s) from both databases
+        with self.metrics.phase('get_rows'):
+            self.get_rows()
+        # if no row exists in the target, insert it here
+        with self.metrics.phase('insert_target'):
+            self.insert_target()
+        # find differences between source and target
+        with self.metrics.phase('find_deltas'):
+            self.find_deltas()
+        # display SQL updates to bring source and target table definitions in-line
+        with self.metrics.phase('schema_updates'):
+            self.show_schema_updates()
+        # update the target database (and back it up)
+        with self.metrics.phase('update_target'):
+            self.update_target()
+
+    def _commit_target(self):
+        """
+        commit the update to the target, unless this is one of several targets being
+        cloned atomically, in which case fan_out commits once every target has succeeded
+        """
+        if self.parent is not None and self.config.getboolean('clone_row', 'atomic'):
+            return
+        self.target['connection'].commit()
+
+    def _count_rows(self, rows):
+        """
+        count rows read from a database, and roughly how many bytes were transferred for them
+
+        Keyword arguments:
+        rows -- list of dicts of rows as returned by PDBC.dict_query
+        """
+        self.metrics.count('rows_read', len(rows))
+        self.metrics.count('bytes_transferred', sum(
+            len(value) if isinstance(value, (bytes, bytearray, memoryview, str)) else len(str(value))
+            for row in rows for value in row.values() if value is not None
+        ))
+
     def _dump_update_sql(self, sql):
         """
         dump the last executed update statement to a file
@@ -133,13 +320,8 @@ class CloneRow(object):
         with open(sql_file, "wb") as outfile:
             outfile.write(sql)
         logging.warning('update sql is available for inspection at %s on this machine', sql_file)
-        if (self.config.has_section('transaction_log') and
-                self.target['alias'] in self.config.get('transaction_log', 'targets').split(',')):
-            self._scp_file(
-                self.config.get('transaction_log', 'hostname'),
-                self.config.get('transaction_log', 'directory'),
-                sql_file
-            )
+        if self.log_shipper is not None:
+            self.log_shipper.ship(sql_file)
 
     def _error(self, message=None, exception=None):
         """
@@ -156,6 +338,8 @@ class CloneRow(object):
             # if you re-raise the original exception (e.g. raise exception), you lose traceback
             logging.error('original traceback below:')
             traceback.print_exc()
+        self._report_trace()
+        self._write_metrics(1)
         sys.exit(1)
 
     @classmethod
@@ -184,6 +368,306 @@ class CloneRow(object):
         log_header += end
         return log_header
 
+    def _fetch_hashed_columns(self):
+        """
+        large columns are compared by hash, replace the hashes in the source row(s) with the
+        real values of any large columns that differ, so they can be cloned
+        """
+        hashed_columns = self.source['hashed_columns']
+        if self.database['batch']:
+            batch_deltas = self.database['batch_deltas']
+        else:
+            batch_deltas = {self.database['filter']: self.database['deltas']}
+        changes = {}
+        for key, deltas in batch_deltas.items():
+            columns = [c for c in deltas['delta_columns'] if c in hashed_columns]
+            if columns:
+                changes[key] = columns
+        if not changes:
+            return
+        columns = sorted(set(c for key_columns in changes.values() for c in key_columns))
+        logging.info('fetching %s changed large columns from %s..', len(columns), self.source['alias'])
+        con = self.source['connection']
+        filter_sql, filter_params = self._get_filter_sql(list(changes.keys()))
+        select_sql = 'select "{0}", {1} from "{2}" where {3}'.format(
+            self.database['column'],
+            ', '.join('"{0}"'.format(c) for c in columns),
+            self.database['table'],
+            filter_sql
+        )
+        # the source connection may be shared with other targets, see fan_out
+        with self.source_lock:
+            rows = con.dict_query(con.mogrify(select_sql, filter_params))
+        self._count_rows(rows)
+        for row in rows:
+            if self.database['batch']:
+                source_row = self.source['rows'][row[self.database['column']]]
+            else:
+                source_row = self.source['row']
+            for column in columns:
+                source_row[column] = row[column]
+
+    @classmethod
+    def _get_deltas(cls, source_row, target_row):
+        """
+        use DictDiffer to find differences between a source and target row
+
+        Keyword arguments:
+        source_row -- dict of the row in the source database
+        target_row -- dict of the same row in the target database
+        """
+        delta = DictDiffer(source_row, target_row)
+        return {
+            'new_columns_in_source': delta.added(),
+            'new_columns_in_target': delta.removed(),
+            'delta_columns': delta.changed(),
+            'unchanged_columns': delta.unchanged()
+        }
+
+    def _get_dependencies(self):
+        """
+        collect the rows linked to the row(s) being cloned by foreign keys (in either direction)
+        to --dependencies levels, reading each level set-wise with one query per table. Returns
+        [(table, primary key column, {key: row})] in the order they have to be applied to the target
+        """
+        foreign_keys, target_foreign_keys = self._run_concurrently(
+            (self.source['connection'].get_foreign_keys, ), (self.target['connection'].get_foreign_keys, )
+        )
+        catalog = self.source['connection'].get_catalog()
+        # the source tells us what's linked, the target what has to exist first
+        foreign_keys += [fk for fk in target_foreign_keys if fk not in foreign_keys]
+        keys = self.database['keys'] if self.database['batch'] else [self.database['filter']]
+        pending = {self.database['table']: {self.database['column']: set(keys)}}
+        queried = set()
+        rows = {}
+        for level in range(self.database['dependencies'] + 1):
+            linked = {}
+            for table, filters in sorted(pending.items()):
+                primary_key = self._get_primary_key(catalog, table)
+                queried.update((table, column, value) for column, values in filters.items() for value in values)
+                for row in self._get_linked_rows(table, filters):
+                    if row[primary_key] in rows.setdefault(table, {}):
+                        continue
+                    rows[table][row[primary_key]] = row
+                    for fk in foreign_keys:
+                        # rows we reference, and rows referencing us
+                        if fk['table'] == table and row[fk['column']] is not None:
+                            linked.setdefault(fk['ref_table'], {}).setdefault(fk['ref_column'], set()) \
+                                .add(row[fk['column']])
+                        if fk['ref_table'] == table and row[fk['ref_column']] is not None:
+                            linked.setdefault(fk['table'], {}).setdefault(fk['column'], set()) \
+                                .add(row[fk['ref_column']])
+            if not rows.get(self.database['table']):
+                self._error('get_rows: no rows found in {0} database - query details (table, column) {1} {2}'.format(
+                    self.source['alias'], self.database['table'], self.database['column']
+                ))
+            logging.info(
+                'level %s: %s rows in %s tables', level, sum(len(table_rows) for table_rows in rows.values()),
+                len([table for table in rows if rows[table]])
+            )
+            # only read what we haven't already
+            pending = {}
+            for table, filters in linked.items():
+                for column, values in filters.items():
+                    values = set(value for value in values if (table, column, value) not in queried)
+                    if values:
+                        pending.setdefault(table, {})[column] = values
+            if not pending:
+                break
+        tables = [table for table in rows if rows[table]]
+        return [
+            (table, self._get_primary_key(catalog, table), rows[table])
+            for table in self._get_dependency_order(tables, foreign_keys)
+        ]
+
+    def _get_dependency_order(self, tables, foreign_keys):
+        """
+        return tables in the order rows have to be applied to the target, every table
+        after those it references
+
+        Keyword arguments:
+        tables -- the tables to order
+        foreign_keys -- foreign keys between them, see PDBC.get_foreign_keys
+        """
+        references = dict((table, set(
+            fk['ref_table'] for fk in foreign_keys
+            if fk['table'] == table and fk['ref_table'] in tables and fk['ref_table'] != table
+        )) for table in tables)
+        ordered = []
+        while references:
+            ready = sorted(table for table, refs in references.items() if not refs - set(ordered))
+            if not ready:
+                self._error('dependencies: foreign keys between {0} are circular, they can\'t be cloned in order'.format(
+                    ', '.join(sorted(references))
+                ))
+            ordered += ready
+            for table in ready:
+                del references[table]
+        return ordered
+
+    def _get_dependency_worker(self, table, primary_key, rows):
+        """
+        return a CloneRow to clone the rows of a single table as part of clone_dependencies. It shares
+        our source and target connections, so every table is cloned in the same target transaction
+
+        Keyword arguments:
+        table -- the table
+        primary_key -- its (single column) primary key, rows are cloned on it
+        rows -- {key: row} of the rows to clone, already read from the source
+        """
+        worker = CloneRow(CloneRow.copy_config(self.config), self.pool)
+        worker.parent = self
+        worker.source_lock = self.source_lock
+        worker.tracer = self.tracer
+        worker.log_shipper = self.log_shipper
+        worker.source = dict(self.source, metadata=None, hashed_columns=[], row={}, rows=rows)
+        worker.target['alias'] = self.target['alias']
+        worker.target['db_name'] = self.target['db_name']
+        worker.target['connection'] = self.target['connection']
+        worker.database.update(table=table, column=primary_key, batch=True, keys=sorted(rows))
+        worker._get_table_config(table) # pylint: disable=locally-disabled,protected-access
+        # every table gets its own backup and update sql, committed together by us
+        worker.config.set(
+            'clone_row', 'dump_filepath',
+            '{0}-{1}'.format(self.config.get('clone_row', 'dump_filepath'), table)
+        )
+        worker.config.set('clone_row', 'atomic', str(True))
+        return worker
+
+    def _get_linked_rows(self, table, filters):
+        """
+        return every row of a table matching any of filters, in one query
+
+        Keyword arguments:
+        table -- the table
+        filters -- {column: values}, e.g. {"parent_id": {1, 2}} selects where "parent_id" in (1, 2)
+        """
+        con = self.source['connection']
+        columns = sorted(filters)
+        select_sql = 'select * from "{0}" where {1}'.format(
+            table, ' or '.join('"{0}" in %s'.format(column) for column in columns)
+        )
+        res = con.dict_query(con.mogrify(select_sql, tuple(tuple(filters[column]) for column in columns)))
+        self._count_rows(res)
+        return res
+
+    def _get_plan(self, host):
+        """
+        return the plan (see PDBC.explain) of looking the row(s) up on a host. Plans of looking a
+        single row up using an index are cached per host alias, table and column, until the table's
+        definition changes
+
+        Keyword arguments:
+        host -- host dict containing params of the host we're looking rows up on
+        """
+        con = host['connection']
+        table = self.database['table']
+        column = self.database['column']
+        # a range or a long list of keys may well be planned as a full scan where a single key isn't,
+        # so batch lookups are always EXPLAINed
+        cache = self.metadata_cache if not self.database['batch'] else None
+        if cache is not None:
+            plan = cache.get_plan(host['alias'], con, host['db_name'], table, column)
+            if plan is not None:
+                logging.info('using cached plan for %s on %s', table, host['alias'])
+                return plan
+        if self.database['batch']:
+            filter_sql, filter_params = self._get_filter_sql()
+            plan = con.explain('select * from "{0}" where {1}'.format(table, filter_sql), filter_params)
+        else:
+            plan = con.explain(
+                'select * from "{0}" where "{1}" = %s'.format(table, column), (self.database['filter'], )
+            )
+        # a full scan is never cached, so an index added since is noticed
+        if cache is not None and not plan['full_scan']:
+            cache.put_plan(host['alias'], con, host['db_name'], table, column, plan)
+        return plan
+
+    def _get_primary_key(self, catalog, table):
+        """
+        return the primary key column of a table, rows are cloned on it when cloning dependencies
+
+        Keyword arguments:
+        catalog -- columns of each table in the source, see PDBC.get_catalog
+        table -- the table
+        """
+        primary_key = [c['name'] for c in catalog.get(table, []) if c['primary_key']]
+        if len(primary_key) != 1:
+            self._error('dependencies: {0} needs a single column primary key to be cloned'.format(table))
+        return primary_key[0]
+
+    def _get_update_params(self, key, columns):
+        """
+        return the params for updating columns of the row with the given key in batch mode
+
+        Keyword arguments:
+        key -- the key of the row
+        columns -- the columns being updated
+        """
+        params = [self.target['connection'].adapt_param(self.source['rows'][key][c]) for c in columns]
+        params.append(key)
+        return tuple(params)
+
+    def _get_filter_sql(self, keys=None):
+        """
+        return the where clause selecting every row in a batch run and its params, e.g.
+        ('"column" in %s', (('a', 'b'), )) or ('"column" between %s and %s', ('a', 'z'))
+
+        Keyword arguments:
+        keys -- list of keys to filter on, defaults to the keys (or range) of the batch
+        """
+        if keys is None:
+            keys = self.database['keys']
+        if keys is None:
+            return '"{0}" between %s and %s'.format(self.database['column']), tuple(self.database['range'])
+        return '"{0}" in %s'.format(self.database['column']), (tuple(keys), )
+
+    def _get_mandatory_columns(self):
+        """ return a list of target columns that are not nullable and have no defaults """
+        return [
+            c['name'] for c in self._get_metadata(self.target)['columns']
+            if not c['nullable'] and c['default'] is None and not c['auto_increment']
+        ]
+
+    def _get_metadata(self, host):
+        """
+        return metadata (columns, encoding) of the table we're working on for host,
+        from the metadata cache if one is configured
+
+        Keyword arguments:
+        host -- host dict containing params of the host
+        """
+        if host['metadata'] is None:
+            if self.metadata_cache is not None:
+                host['metadata'] = self.metadata_cache.get(
+                    host['alias'], host['connection'], host['db_name'], self.database['table']
+                )
+            else:
+                host['metadata'] = host['connection'].get_table_metadata(
+                    host['db_name'], self.database['table']
+                )
+        return host['metadata']
+
+    def _get_restore_delete_sql(self):
+        """ return the lines of sql deleting every row cloned, to restore the backup by hand """
+        con = self.target['connection']
+        if self.database['batch']:
+            keys = self.target['backup_keys'] + self.target['new_keys']
+            filter_sql, filter_params = self._get_filter_sql(keys)
+            return [
+                '    ' + con.mogrify(
+                    'delete from {0} where {1};'.format(self.database['table'], filter_sql), filter_params
+                ).decode(encoding='UTF-8'),
+                '    -- if more than {0} rows have been deleted above run `rollback;`'.format(len(keys))
+            ]
+        return [
+            '    ' + con.mogrify(
+                'delete from {0} where {1} = %s;'.format(self.database['table'], self.database['column']),
+                (self.database['filter'], )
+            ).decode(encoding='UTF-8'),
+            '    -- if more than one row has been deleted above run `rollback;`'
+        ]
+
     def _get_row(self, host):
         """
         Run a select query returning a dict including column headers.
@@ -199,14 +683,16 @@ class CloneRow(object):
             # if we're only doing schema diffs we don't care about columns or filters
             # we can just select the first row from the table
             select_sql = 'select * from "{0}" limit 1'.format(self.database['table'])
+            res = con.dict_query(select_sql)
         else:
-            select_sql = 'select * from "{0}" where "{1}" = {2}'.format(
+            select_sql = 'select {0} from "{1}" where "{2}" = %s'.format(
+                self._get_select_sql(host),
                 self.database['table'],
-                self.database['column'],
-                self._quote_sql_param(self.database['filter'])
+                self.database['column']
             )
-
-        res = con.dict_query(select_sql)
+            # prepared, the same select is reused for every row cloned from this table
+            res = con.dict_query(select_sql, (self.database['filter'], ))
+        self._count_rows(res)
 
         # we should only _ever_ be playing with one row, per host, at a time
         if len(res) == 0:
@@ -216,6 +702,225 @@ class CloneRow(object):
             self._error('get_row: Only one row expected -- cannot clone on multiple rows!')
         return res[0]
 
+    def _get_rows(self, host):
+        """
+        Run a select query returning a dict of rows keyed on the filter column.
+        Used in batch mode, where any number of rows may be returned.
+
+        Keyword arguments:
+        host -- host dict containing params of the host we're selecting from
+        """
+        logging.info('getting %s rows..', host['alias'])
+        filter_sql, filter_params = self._get_filter_sql()
+        select_sql = 'select {0} from "{1}" where {2}'.format(
+            self._get_select_sql(host), self.database['table'], filter_sql
+        )
+        # streamed, so the rows are only ever held once, here
+        rows = {}
+        stream = host['connection'].stream_query(select_sql, filter_params)
+        for row in stream:
+            key = row[self.database['column']]
+            # rows are keyed on the column, a second row for a key would silently replace the first
+            if key in rows:
+                stream.close()
+                self._error('get_rows: {0} is not unique in {1} on {2}, more than one row has {0} = {3}'.format(
+                    self.database['column'], self.database['table'], host['alias'], key
+                ))
+            rows[key] = row
+        self._count_rows(list(rows.values()))
+        return rows
+
+    def _get_batch_rows(self):
+        """ get every row in the batch from source and target databases """
+        if self.database['table_sync']:
+            self.database['keys'] = self._get_sync_keys()
+            if not self.database['keys']:
+                logging.warning('data is identical in target and source, nothing to do..')
+                self.exit(5)
+        if self.database['incremental']:
+            self.database['keys'] = self._get_watermark_keys()
+            if not self.database['keys']:
+                logging.warning('no rows have changed in source since the last clone, nothing to do..')
+                self.exit(5)
+        with self.metrics.phase('check_plans'):
+            self._check_plans()
+        if self.parent is not None:
+            # the source rows have already been read once for every target
+            self.target['rows'] = self._get_rows(self.target)
+        else:
+            self.source['rows'], self.target['rows'] = self._run_concurrently(
+                (self._get_rows, self.source), (self._get_rows, self.target)
+            )
+            self._check_source_rows()
+        self.target['rows'] = dict(
+            (key, row) for key, row in self.target['rows'].items() if key in self.source['rows']
+        )
+        logging.info(
+            '%s rows found in %s, %s of which exist in %s',
+            len(self.source['rows']), self.source['alias'],
+            len(self.target['rows']), self.target['alias']
+        )
+        with self.metrics.phase('check_encoding'):
+            self._check_encoding()
+
+    def _get_select_sql(self, host):
+        """
+        return the select list for rows on the given host. With --hash_large_columns,
+        large columns are replaced by their md5 so we don't transfer them just to diff
+
+        Keyword arguments:
+        host -- host dict containing params of the host we're selecting from
+        """
+        if not self.config.getboolean('clone_row', 'hash_large_columns'):
+            return '*'
+        con = host['connection']
+        columns = self._get_metadata(host)['columns']
+        # never hash the column we're filtering on, we key rows on it
+        host['hashed_columns'] = [
+            c['name'] for c in columns
+            if con.is_large_type(c['type']) and c['name'] != self.database['column']
+        ]
+        return ', '.join(
+            '{0} as "{1}"'.format(con.get_hash_sql(c['name'], c['type']), c['name'])
+            if c['name'] in host['hashed_columns'] else '"{0}"'.format(c['name'])
+            for c in columns
+        )
+
+    def _get_sync_keys(self):
+        """
+        walk the whole table on column in keyset paginated chunks, comparing checksums of
+        each chunk computed on the source and target servers. Only chunks which differ
+        are drilled down into, returning the keys of rows which need cloning
+        """
+        source_con = self.source['connection']
+        target_con = self.target['connection']
+        table = self.database['table']
+        column = self.database['column']
+        if source_con.driver != target_con.driver:
+            self._error('table_sync: checksums cannot be compared across different drivers')
+        source_meta, target_meta = self._run_concurrently(
+            (self._get_metadata, self.source), (self._get_metadata, self.target)
+        )
+        target_columns = [c['name'] for c in target_meta['columns']]
+        columns = [
+            c['name'] for c in source_meta['columns']
+            if c['name'] in target_columns and c['name'] not in self.database['ignore_columns']
+        ]
+        chunk_size = self.config.getint('clone_row', 'chunk_size')
+        logging.info('comparing %s in chunks of %s rows..', table, chunk_size)
+        keys = []
+        chunks = 0
+        mismatches = 0
+        low = None
+        while True:
+            high = source_con.get_chunk_bound(table, column, low, chunk_size)
+            if high is None:
+                break
+            chunks += 1
+            source_checksum, target_checksum = self._run_concurrently(
+                (source_con.get_chunk_checksum, table, column, columns, low, high),
+                (target_con.get_chunk_checksum, table, column, columns, low, high)
+            )
+            if source_checksum != target_checksum:
+                mismatches += 1
+                source_hashes, target_hashes = self._run_concurrently(
+                    (source_con.get_row_checksums, table, column, columns, low, high),
+                    (target_con.get_row_checksums, table, column, columns, low, high)
+                )
+                keys += [
+                    key for key, row_hash in source_hashes.items()
+                    if target_hashes.get(key) != row_hash
+                ]
+            low = high
+        logging.info(
+            '%s of %s chunks differ, %s rows need cloning', mismatches, chunks, len(keys)
+        )
+        return keys
+
+    def _get_target_aliases(self):
+        """ return the aliases of every target we're cloning to """
+        if not self.config.has_section('clone_row'):
+            return [self.target['alias']]
+        return self.config.get('clone_row', 'targets').split(',')
+
+    def _get_worker(self, target_alias):
+        """
+        return a CloneRow to clone to a single target as part of fan_out. It shares our source
+        connection and the source row(s) we've already read, but has its own copy of the rows
+        so large columns can be fetched into them independently
+
+        Keyword arguments:
+        target_alias -- the configured alias of the target host
+        """
+        worker = CloneRow(CloneRow.copy_config(self.config), self.pool)
+        worker.parent = self
+        worker.source_lock = self.source_lock
+        worker.source = dict(
+            self.source, row=copy.deepcopy(self.source['row']), rows=copy.deepcopy(self.source['rows'])
+        )
+        worker.target['alias'] = target_alias
+        worker.target['db_name'] = self.config.get('host.' + target_alias, 'database')
+        worker.database = copy.deepcopy(self.database)
+        # every target gets its own backup and update sql
+        worker.config.set(
+            'clone_row', 'dump_filepath',
+            '{0}-{1}'.format(self.config.get('clone_row', 'dump_filepath'), target_alias)
+        )
+        worker.config.set('clone_row', 'targets', target_alias)
+        worker.tracer = self.tracer
+        if self.log_shipper is not None and \
+                target_alias in self.config.get('transaction_log', 'targets').split(','):
+            worker.log_shipper = self.log_shipper
+        return worker
+
+    def _get_watermark_keys(self):
+        """
+        return the keys of every source row changed since the last successful clone to the
+        target (a range scan on watermark_column), noting the new high-water mark
+        """
+        con = self.source['connection']
+        column = self.database['watermark_column']
+        watermark = self.watermark_store.get(
+            self.source['alias'], self.target['alias'], self.database['table'], column
+        )
+        select_sql = 'select "{0}", "{1}" from "{2}"'.format(
+            self.database['column'], column, self.database['table']
+        )
+        if watermark is None:
+            logging.warning('no watermark for %s from %s to %s yet, every row will be compared',
+                            self.database['table'], self.source['alias'], self.target['alias'])
+            res = con.stream_query(select_sql)
+        else:
+            # rows on the mark itself are read again, in case more were committed with it
+            logging.info('finding rows where %s >= %s..', column, watermark)
+            res = con.stream_query(select_sql + ' where "{0}" >= %s'.format(column), (watermark, ))
+        # streamed, only the keys are kept, however many rows there are
+        keys = []
+        mark = None
+        for row in res:
+            keys.append(row[self.database['column']])
+            if row[column] is not None and (mark is None or row[column] > mark):
+                mark = row[column]
+        if mark is not None:
+            self.database['watermark'] = mark
+        self.metrics.count('rows_read', len(keys))
+        logging.info('%s rows have changed since the last clone', len(keys))
+        return keys
+
+    def _get_catalog(self, host):
+        """
+        connect to a host, returning the columns of every table matching the table glob
+
+        Keyword arguments:
+        host -- host dict containing params of the host
+        """
+        host['connection'] = self._connect(host['alias'])
+        logging.info('reading %s catalog..', host['alias'])
+        return dict(
+            (table, columns) for table, columns in host['connection'].get_catalog().items()
+            if fnmatch.fnmatchcase(table, self.database['table'])
+        )
+
     def _get_table_config(self, table):
         """
         get table specific config items, if any, as defined in config (table.mytable)
@@ -227,6 +932,9 @@ class CloneRow(object):
         if not self.config.has_section(table_section):
             logging.warning('no table specific config defined for %s', table)
             return
+        self.database['watermark_column'] = self.config.get(
+            table_section, 'watermark_column', fallback=None
+        )
         try:
             # unfortunately configparser doesn't support lists, this is as nice as anything
             self.database['ignore_columns'] = self.config.get(
@@ -240,6 +948,13 @@ class CloneRow(object):
             logging.warning('_get_table_config: no ignore_columns for %s', table)
             return
 
+    def _get_backup_file(self):
+        """ return the path of the backup file, exporting it from the backup store if need be """
+        if self.target['backup_id'] is not None and not os.path.exists(self.target['backup']):
+            logging.info('exporting backup %s from backup store..', self.target['backup_id'])
+            self.backup_store.export(self.target['backup_id'], self.target['backup'])
+        return self.target['backup']
+
     def _get_dump_filepath(self):
         """
         return the unload filepath for us to use for backups and sql dumps
@@ -250,18 +965,226 @@ class CloneRow(object):
         dump_file += '/{0}-{1}-{2}-{3}'.format(
             self.database['table'],
             self.database['column'],
-            self.database['filter'],
+            'batch' if self.database['batch'] else self.database['filter'],
             int(round(time.time() * 1000))
         )
         return dump_file
 
+    def _get_fan_out_code(self, codes):
+        """
+        return the code to exit with after fanning out: the code every target agrees on,
+        otherwise 1 if any target failed, otherwise 0
+
+        Keyword arguments:
+        codes -- the code each target would have exited with on its own
+        """
+        if len(set(codes)) == 1:
+            return codes[0]
+        if [code for code in codes if code not in [0, 5, 6]]:
+            return 1
+        return 0
+
     def _housekeep(self):
-        """ close any existing connections """
+        """ close any existing connections (or return them to the pool) """
         logging.info('housekeeping..')
-        if self.source['connection'] is not None:
-            self.source['connection'].close()
-        if self.target['connection'] is not None:
-            self.target['connection'].close()
+        # we may be called from a worker thread, so don't wait on the pool here
+        self.executor.shutdown(wait=False)
+        for worker in self.workers:
+            worker._housekeep() # pylint: disable=locally-disabled,protected-access
+        # workers borrow the source connection and log shipper from their parent,
+        # and when cloning dependencies, the target connection too
+        hosts = [self.source, self.target] if self.parent is None else [self.target]
+        for host in hosts:
+            if host['connection'] is None:
+                continue
+            if self.parent is not None and host['connection'] is self.parent.target['connection']:
+                continue
+            if self.pool is not None:
+                self.pool.put(host['alias'], host['connection'])
+            else:
+                host['connection'].close()
+            host['connection'] = None
+        if self.log_shipper is not None and self.parent is None:
+            with self.metrics.phase('ship_logs'):
+                self.log_shipper.close(
+                    self.config.getint('transaction_log', 'flush_timeout', fallback=10)
+                )
+            self.log_shipper = None
+
+    def _delete_batch_target(self):
+        """ delete every row backed up or inserted by a batch run, as the first step of restoring it """
+        keys = self.target['backup_keys'] + self.target['new_keys']
+        cur = self.target['connection'].cursor()
+        delete_sql = 'delete from {0} where {1} in ({2})'.format(
+            self.database['table'], self.database['column'], ', '.join(['%s'] * len(keys))
+        )
+        cur.execute(delete_sql, tuple(keys))
+        deleted = self.target['connection'].affected_rows(cur)
+        if deleted != len(keys):
+            cur.close()
+            self.target['connection'].rollback()
+            self._error('restore_target: expected to delete {0} rows, deleted {1}'.format(len(keys), deleted))
+        cur.close()
+
+    def _insert_batch_target(self):
+        """
+        insert minimal rows into the target database for every key in the batch
+        which doesn't exist there yet, then reselect the batch
+        """
+        new_keys = [key for key in self.database['keys'] if key not in self.target['rows']]
+        if not new_keys:
+            return
+        columns = self._get_mandatory_columns()
+        columns.append(self.database['column'])
+        columns = list(set(columns))
+        logging.info('inserting %s minimal rows into target database..', len(new_keys))
+        ret = self.target['connection'].bulk_insert(self.database['table'], columns, [
+            tuple(self.source['rows'][key][column] for column in columns) for key in new_keys
+        ])
+        if ret != len(new_keys):
+            self.target['connection'].rollback()
+            self._error('insert_target: expected to insert {0} rows'.format(len(new_keys)))
+        self.target['new_keys'] = new_keys
+        self.target['rows'] = self._get_rows(self.target)
+
+    def _load_backup(self, rows):
+        """
+        load the backup of the target in bulk (COPY or multi-row inserts), once the rows it
+        replaces have been deleted. The backup is checked against its manifest before it's
+        loaded, and the rows loaded against the manifest after
+
+        Keyword arguments:
+        rows -- number of rows we backed up
+        """
+        backup_file = self._get_backup_file()
+        if not self.target['connection'].validate_dump(backup_file, rows):
+            self.target['connection'].rollback()
+            self._error('restore_target: backup {0} does not match its manifest'.format(backup_file))
+        ret = self.target['connection'].load(backup_file, self.database['table'])
+        if ret != rows:
+            self.target['connection'].rollback()
+            self._error('restore_target: expected to load {0} rows, loaded {1}'.format(rows, ret))
+
+    def _load_batch_target(self):
+        """ load the backup of a batch run, once its rows have been deleted """
+        if self.target['backup_keys']:
+            self._load_backup(len(self.target['backup_keys']))
+
+    def _print_schema_drift(self, source_catalog, target, target_catalog):
+        """
+        log every difference between the source and target catalogs, with sql to fix
+        missing columns, returning the number of differences
+
+        Keyword arguments:
+        source_catalog -- columns of each table in the source, see PDBC.get_catalog
+        target -- host dict of the target
+        target_catalog -- columns of each table in the target
+        """
+        changes = 0
+        # types can only be compared like for like
+        compare_types = self.source['connection'].driver == target['connection'].driver
+        for table in sorted(set(source_catalog) | set(target_catalog)):
+            if table not in source_catalog or table not in target_catalog:
+                working_db, other_db = (self.source['alias'], target['alias']) \
+                    if table in source_catalog else (target['alias'], self.source['alias'])
+                logging.info('')
+                logging.info(self._get_log_break('|Schema Change - Table: {0}|'.format(table)))
+                logging.info('  Table \'%s\' exists in the %s database but not in %s', table, working_db, other_db)
+                logging.info(self._get_log_break())
+                changes += 1
+                continue
+            hosts = [
+                (self.source, source_catalog[table], target_catalog[table], target['alias']),
+                (target, target_catalog[table], source_catalog[table], self.source['alias'])
+            ]
+            for host, columns, other_columns, other_db in hosts:
+                other_names = [c['name'] for c in other_columns]
+                for column in [c for c in columns if c['name'] not in other_names]:
+                    self._print_column_sql(host['connection'], table, column, host['alias'], other_db)
+                    changes += 1
+            if not compare_types:
+                continue
+            target_columns = dict((c['name'], c) for c in target_catalog[table])
+            for column in source_catalog[table]:
+                other = target_columns.get(column['name'])
+                if other is None or (column['column_type'], column['nullable']) == \
+                        (other['column_type'], other['nullable']):
+                    continue
+                logging.info('')
+                logging.info(self._get_log_break('|Schema Change - Column: {0}|'.format(column['name'])))
+                for host, definition in [(self.source, column), (target, other)]:
+                    logging.info(
+                        '  %s.%s is %s%s in the %s database', table, column['name'],
+                        definition['column_type'], '' if definition['nullable'] else ' not null',
+                        host['alias']
+                    )
+                logging.info(self._get_log_break())
+                changes += 1
+        return changes
+
+    def _print_fan_out_summary(self, codes, rolled_back):
+        """
+        log the outcome of fanning out for each target (or each table, cloning dependencies)
+
+        Keyword arguments:
+        codes -- the code each target would have exited with on its own, None if it wasn't cloned
+        rolled_back -- True if every target was rolled back as one of them failed (--atomic)
+        """
+        outcomes = {
+            None: 'not cloned as another table failed',
+            0: 'cloned',
+            5: 'data is identical in target and source, nothing to do',
+            6: 'all changes are configured to be ignored, nothing to do'
+        }
+        kind = 'table' if self.database['dependencies'] else 'target'
+        logging.info('')
+        logging.info(self._get_log_break('|{0}s|'.format(kind.capitalize())))
+        for worker, code in zip(self.workers, codes):
+            if rolled_back and code == 0:
+                outcome = 'rolled back as another {0} failed'.format(kind)
+            elif code == 0 and self.config.getboolean('clone_row', 'schema_only'):
+                outcome = 'schema compared'
+            elif code == 0 and worker.database['batch']:
+                outcome = 'cloned {0} rows'.format(len(worker.target['changed_keys']))
+            else:
+                outcome = outcomes.get(code, 'failed (exit code {0})'.format(code))
+            name = worker.database['table'] if kind == 'table' else worker.target['alias']
+            logging.info('  %s: %s', name, outcome)
+            if worker.target['backup'] is not None and not rolled_back and code == 0:
+                logging.info('    backup: %s', worker.target['backup'])
+        logging.info(self._get_log_break())
+        logging.info('')
+
+    def _print_column_sql(self, pdbc, table, column, working_db, other_db):
+        """
+        log sql to add a column missing from one database, or drop it from the one it's in
+
+        Keyword arguments:
+        pdbc -- PDBC connection to the database the column is in
+        table -- the table the column belongs to
+        column -- dict describing the column, see PDBC.get_columns
+        working_db -- alias of the database the column is in
+        other_db -- alias of the database the column is missing from
+        """
+        logging.info('')
+        logging.info(self._get_log_break('|Schema Change - Column: {0}|'.format(column['name'])))
+        logging.info(
+            '  Column \'%s\' exists in the %s database but not in %s',
+            column['name'], working_db, other_db
+        )
+        info = pdbc.get_column_sql(table, column)
+        logging.info(
+            '  To Add Column \'%s\' to %s, run the following SQL on %s:',
+            column['name'], other_db, other_db
+        )
+        logging.warning('    ' + info['add_sql'])
+        logging.info(
+            '  To Drop Column \'%s\' from %s, run the following SQL on %s:',
+            column['name'], working_db, working_db
+        )
+        logging.warning('    ' + info['drop_sql'])
+        logging.info(self._get_log_break())
+        logging.info('')
 
     def _print_delta_columns(self, deltas):
         """
@@ -281,22 +1204,64 @@ class CloneRow(object):
         logging.info('')
 
     @classmethod
-    def _quote_sql_param(cls, sql_param):
+    def _read_filter_file(cls, filter_file):
         """
-        encapsulate an sql paramter in quotes if necessary
+        return the list of filter values in a file, one per line
 
         Keyword arguments:
-        sql_param -- the sql paramter to operate on
+        filter_file -- path to the file
         """
-        # we want to quote strings and dates (and probably more..?)
-        if isinstance(sql_param, str) or isinstance(sql_param, datetime.datetime):
-            return '\'{0}\''.format(sql_param)
-        else:
-            # doesn't need quoting
-            return sql_param
+        with open(filter_file) as handle:
+            return [line.strip() for line in handle if line.strip() != '']
+
+    def _report_trace(self):
+        """ log the slowest statements traced (--trace) and write the trace file (--trace_file), if any """
+        # workers share our tracer, we report for every target at once
+        if self.tracer is None or self.parent is not None:
+            return
+        top = self.config.getint('clone_row', 'trace')
+        if top:
+            logging.info(self._get_log_break('|Slowest Statements|'))
+            logging.info('%6s %10s %10s %10s %12s  %s', 'calls', 'total s', 'max s', 'rows', 'bytes', 'host: sql')
+            for statement in self.tracer.summarise(top):
+                logging.info(
+                    '%6d %10.4f %10.4f %10d %12d  %s: %s',
+                    statement['calls'], statement['seconds'], statement['max_seconds'],
+                    statement['rows'], statement['bytes'], statement['host'], statement['sql'][:200]
+                )
+        trace_file = self.config.get('clone_row', 'trace_file')
+        if trace_file:
+            self.tracer.write(trace_file)
+            logging.info('every statement traced written to %s', trace_file)
+
+    def _restore_batch_target(self):
+        """ restore every row changed by a batch run, in a single transaction """
+        self._delete_batch_target()
+        self._load_batch_target()
+        self.target['connection'].commit()
+
+    def _restore_dependencies(self):
+        """ restore every table cloned by clone_dependencies, in a single transaction """
+        workers = [worker for worker in self.workers if worker.target['backup_keys'] or worker.target['new_keys']]
+        # rows have to be deleted before the rows they reference, and loaded after them
+        for worker in reversed(workers):
+            worker._delete_batch_target() # pylint: disable=locally-disabled,protected-access
+        for worker in workers:
+            worker._load_batch_target() # pylint: disable=locally-disabled,protected-access
+        self.target['connection'].commit()
 
     def _restore_target(self):
         """ restore data unloaded from the target database """
+        if self.database['dependencies']:
+            return self._restore_dependencies()
+        if self.workers:
+            for worker in self.workers:
+                if worker.target['connection'] is not None:
+                    logging.warning('restoring %s..', worker.target['alias'])
+                    worker._restore_target() # pylint: disable=locally-disabled,protected-access
+            return
+        if self.database['batch']:
+            return self._restore_batch_target()
         cur = self.target['connection'].cursor()
         delete_sql = 'delete from {0} where {1} = %s'.format(
             self.database['table'], self.database['column']
@@ -313,142 +1278,469 @@ class CloneRow(object):
             cur.close()
             self.target['connection'].commit()
             return
-        ret = self.target['connection'].load(self.target['backup'], self.database['table'])
-        if ret != 1:
-            cur.close()
-            self.target['connection'].rollback()
-            self._error('restore_target: expected to load exactly one row')
         cur.close()
+        self._load_backup(1)
         self.target['connection'].commit()
 
-    @classmethod
-    def _scp_file(cls, host, directory, filepath):
+    def _reset_target(self):
+        """
+        roll back the target and forget everything read from or done to it,
+        so the clone can be run again from the top
         """
-        copy a local file to a remote hostname
+        if self.target['unload'] is not None:
+            # the backup shares the target connection, let it finish (or fail) first
+            concurrent.futures.wait([self.target['unload']])
+        self.target['connection'].rollback()
+        self.target.update(
+            backup=None, backup_id=None, backup_keys=[], changed_keys=[], hashed_columns=[],
+            new_insert=False, new_keys=[], row={}, rows={}, unload=None
+        )
+        self.database.update(deltas={}, batch_deltas={})
+
+    def _retry(self, unit):
+        """
+        run unit, running it again from the top with exponential backoff if the target hits
+        a deadlock or serialization failure, up to --retries times. The target row(s) are
+        re-read each time, so the backup is always of what's being updated
 
         Keyword arguments:
-        host: hostname of remote machine
-        directory: diretory on remote machine
-        filepath: path to local file
+        unit -- function to run, see _clone_rows
         """
-        logging.info('scp\'ing ' + filepath + ' to ' + host + ':' + directory)
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.load_host_keys(os.path.expanduser(os.path.join('~', '.ssh', 'known_hosts')))
-        ssh_config_path = os.path.expanduser(os.path.join('~', '.ssh', 'config'))
+        retries = self.config.getint('clone_row', 'retries')
+        # tables cloned with their dependencies share a transaction, one can't be retried alone
+        if self.parent is not None and self.parent.database['dependencies']:
+            retries = 0
+        attempt = 0
+        while True:
+            try:
+                return unit()
+            except Exception as ex: # pylint: disable=locally-disabled,broad-except
+                if attempt >= retries or not self.target['connection'].is_retryable(ex):
+                    raise
+                attempt += 1
+                # 1s, 2s, 4s.. with jitter, so clones deadlocking each other don't meet again
+                delay = 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logging.warning(
+                    '%s on %s, retrying in %.1fs (%s of %s)..',
+                    str(ex).strip().split('\n')[0], self.target['alias'], delay, attempt, retries
+                )
+                self.metrics.count('retries')
+                self._reset_target()
+                time.sleep(delay)
 
-        if os.path.exists(ssh_config_path):
-            config = paramiko.SSHConfig()
-            config.parse(open(ssh_config_path))
-            ssh_config = config.lookup(host)
-        else:
-            ssh_config = {}
-
-        connect_options = {'hostname': host}
-
-        for key in ssh_config:
-            if key == 'identityfile':
-                connect_options['key_filename'] = ssh_config[key]
-            elif key == 'port':
-                connect_options[key] = int(ssh_config[key])
-            elif key == 'proxycommand':
-                connect_options['sock'] = paramiko.ProxyCommand(ssh_config[key])
-            elif key == 'user':
-                connect_options['username'] = ssh_config[key]
-            else:
-                connect_options[key] = ssh_config[key]
+    def _run_concurrently(self, *calls):
+        """
+        run each call on the thread pool at the same time, returning their results in order
 
-        ssh.connect(**connect_options)
-        sftp = ssh.open_sftp()
-        sftp.put(filepath, os.path.join(directory, os.path.basename(filepath)))
-        sftp.close()
-        ssh.close()
+        Keyword arguments:
+        calls -- tuples of (function, arg, arg..)
+        """
+        futures = [self.executor.submit(*call) for call in calls]
+        return [future.result() for future in futures]
 
-    def _unload_target(self):
-        """ unload the row we're working on from the target database for backup purposes """
-        logging.info('backing up target row..')
-        dump_file = self.config.get('clone_row', 'dump_filepath') + '.backup'
-        error_log = '/tmp/clone_row_dump.error'
-        target_alias = self.target['alias']
-        password = self.config.get('host.' + target_alias, 'password')
+    def _save_watermark(self, code):
+        """
+        store the high-water mark of an incremental clone, once it has succeeded
 
-        args = {
-            'host': self.config.get('host.' + target_alias, 'hostname'),
-            'user': self.config.get('host.' + target_alias, 'username'),
-            'port': self.config.get('host.' + target_alias, 'port'),
-            'database': self.target['db_name'],
+        Keyword arguments:
+        code -- the code we're exiting with
+        """
+        if self.database['watermark'] is None or code not in [0, 5, 6]:
+            return
+        self.watermark_store.put(
+            self.source['alias'], self.target['alias'], self.database['table'],
+            self.database['watermark_column'], self.database['watermark']
+        )
+        logging.info('%s watermark is now %s', self.database['table'], self.database['watermark'])
+
+    def _start_log_shipper(self):
+        """
+        start shipping transaction logs (backups and update sql) in the background,
+        if any of the targets are configured to have them shipped
+        """
+        if not (self.config.has_section('transaction_log') and set(self._get_target_aliases()) &
+                set(self.config.get('transaction_log', 'targets').split(','))):
+            return
+        # paramiko is slow to import, only do so if we're shipping
+        from LogShipper import LogShipper # pylint: disable=locally-disabled,import-outside-toplevel
+        self.log_shipper = LogShipper(
+            self.config.get('transaction_log', 'hostname'),
+            self.config.get('transaction_log', 'directory'),
+            self.config.get('transaction_log', 'spool_dir', fallback='~/.clone-row/spool')
+        )
+
+    def _start_unload(self):
+        """
+        start backing up the target row(s) in the background. The backup only depends on the
+        target rows we've already selected, so it can overlap with finding deltas
+        """
+        if self.config.getboolean('clone_row', 'schema_only'):
+            return
+        keys = None
+        if self.database['batch']:
+            keys = [key for key in self.database['keys'] if key not in self.target['new_keys']]
+            if not keys:
+                logging.info('not backing up target as every row was inserted from scratch..')
+                return
+            self.target['backup_keys'] = keys
+        elif self.target['new_insert']:
+            logging.info('not backing up target on new insert..')
+            return
+        self.target['unload'] = self.executor.submit(self._unload_target, keys)
+
+    def _write_metrics(self, code):
+        """
+        write the metrics of this run (and of each target we've fanned out to), see Metrics
+
+        Keyword arguments:
+        code -- the code we're exiting with
+        """
+        for worker in self.workers:
+            worker._write_metrics(code) # pylint: disable=locally-disabled,protected-access
+        self.metrics.write({
+            'source': self.source['alias'],
+            'target': ','.join(self._get_target_aliases()),
             'table': self.database['table'],
-            'column': self.database['column'],
-            'filter': self.database['filter'],
-            'dump_file': dump_file,
-            'error_log': error_log
-        }
+            'mode': 'batch' if self.database['batch'] else 'single'
+        }, code)
 
-        if password is not None and password != '':
-            args['password'] = password
+    def _wait_for_unload(self):
+        """ wait for the background backup of the target (if any) to complete """
+        if self.target['unload'] is not None:
+            self.target['backup'] = self.target['unload'].result()
+            self.target['unload'] = None
 
-        ret = self.target['connection'].dump(args)
+    def _unload_target(self, keys=None):
+        """
+        unload the row we're working on from the target database for backup purposes
+
+        Keyword arguments:
+        keys -- in batch mode, the list of keys to unload
+        """
+        logging.info('backing up target row%s..', '' if keys is None else 's')
+        dump_file = self.config.get('clone_row', 'dump_filepath') + '.backup'
 
-        if ret is not None:
-            logging.error('an issue occurred running dump, see ' + error_log)
-            self._error('dump exited with non zero error code of ' + str(ret))
+        # dumped over the target connection, so we back up exactly what we selected
+        with self.metrics.phase('unload_target'):
+            written = self.target['connection'].dump({
+                'table': self.database['table'],
+                'column': self.database['column'],
+                'filter': self.database['filter'] if keys is None else list(keys),
+                'dump_file': dump_file
+            })
 
-        if not self.target['connection'].validate_dump(dump_file):
+        # just written, so there's no need to read the whole backup back to check it
+        if not self.target['connection'].validate_dump(dump_file, 1 if keys is None else len(keys), written):
             self._error('unload_target: unable to verify unload file ' + dump_file)
-
-        logging.warning('backup file can be found at %s on this machine', dump_file)
+        self.metrics.count('backup_bytes', os.path.getsize(dump_file))
 
         # upload the backup file to transactional log store if applicable
-        if (self.config.has_section('transaction_log') and
-                self.target['alias'] in self.config.get('transaction_log', 'targets').split(',')):
-            self._scp_file(
-                self.config.get('transaction_log', 'hostname'),
-                self.config.get('transaction_log', 'directory'),
-                dump_file
+        if self.log_shipper is not None:
+            self.log_shipper.ship(dump_file)
+
+        # keep the backup in the store rather than as yet another file in unload_dir
+        if self.backup_store is not None:
+            self.target['backup_id'] = self.backup_store.put(self.target['alias'], dump_file)
+            os.remove(dump_file)
+            os.remove(dump_file + '.manifest')
+            logging.warning(
+                'backup %s can be found in backup store %s',
+                self.target['backup_id'], self.backup_store.directory
             )
+        else:
+            logging.warning('backup file can be found at %s on this machine', dump_file)
         return dump_file
 
+    def _update_batch_target(self):
+        """
+        apply differences in the source database to every row of the batch on the target,
+        backing up and updating set-wise in a single transaction
+        """
+        changes = {}
+        for key in self.database['keys']:
+            columns = [
+                c for c in self.database['batch_deltas'][key]['delta_columns']
+                if c not in self.database['ignore_columns']
+            ]
+            if columns:
+                changes[key] = columns
+        if not len(self.database['deltas']['delta_columns']):
+            logging.warning('data is identical in target and source, nothing to do..')
+            self.exit(5)
+        if not changes:
+            logging.warning('all changes are configured to be ignored, nothing to do..')
+            self.exit(6)
+        self._print_delta_columns(self.database['deltas']['delta_columns'])
+        self.target['changed_keys'] = [key for key in self.database['keys'] if key in changes]
+        self.metrics.count('columns_changed', len(set(c for columns in changes.values() for c in columns)))
+        self.metrics.count('rows_changed', len(changes))
+        self._wait_for_unload()
+        logging.info('updating %s rows on %s..', len(changes), self.target['alias'])
+        # rows changing the same columns can be updated together
+        groups = {}
+        for key in self.target['changed_keys']:
+            groups.setdefault(tuple(sorted(changes[key])), []).append(key)
+        con = self.target['connection']
+        bulk_threshold = self.config.getint('clone_row', 'bulk_threshold')
+        cur = con.cursor()
+        executed = []
+        for columns, keys in groups.items():
+            update_sql = 'update "{0}" set {1} where {2} = %s'.format(
+                self.database['table'],
+                ', '.join('"{0}" = %s'.format(column) for column in columns),
+                self.database['column']
+            )
+            if bulk_threshold and len(keys) >= bulk_threshold:
+                logging.info('bulk updating %s rows..', len(keys))
+                ret = con.bulk_update(self.database['table'], self.database['column'], list(columns), [
+                    (key, ) + tuple(self.source['rows'][key][column] for column in columns)
+                    for key in keys
+                ])
+                if ret != len(keys):
+                    con.rollback()
+                    cur.close()
+                    self._error('update_target: expected to update {0} rows'.format(len(keys)))
+                # the statements weren't run as such, but they're what we've done
+                executed += [con.mogrify(update_sql, self._get_update_params(key, columns)) for key in keys]
+                continue
+            for key in keys:
+                # prepared once for the group, then executed for each row in it
+                con.execute_prepared(cur, update_sql, self._get_update_params(key, columns))
+                executed.append(con.mogrify(update_sql, self._get_update_params(key, columns)))
+                if con.affected_rows(cur) != 1:
+                    con.rollback()
+                    cur.close()
+                    self._error('update_target: expected to update a single row for {0}'.format(key))
+        self._dump_update_sql(b';\n'.join(executed) + b';\n')
+        # don't commit anything until every row has gone in ok
+        cur.close()
+        self._commit_target()
+
     #
     # PUBLIC methods
     #
 
+    def clone(self):
+        """
+        clone the row(s) set up by parse_cla from source to target, exits when done
+        https://en.wikipedia.org/wiki/Dolly_(sheep)
+        """
+        if self.database['table_glob']:
+            return self.scan_schema()
+        if len(self._get_target_aliases()) > 1:
+            return self.fan_out()
+        if self.database['dependencies']:
+            return self.clone_dependencies()
+        # establish a connection to source and target databases
+        with self.metrics.phase('connect'):
+            self.set_connections()
+        # get, diff, back up and update, again from the top if the target deadlocks
+        # the connections are gone by the time an error (or exit) gets here, see _housekeep
+        driver_errors = (self.source['connection'].driver.Error, self.target['connection'].driver.Error)
+        try:
+            self._retry(self._clone_rows)
+        except driver_errors as ex:
+            # e.g. a lock or statement timeout, nothing's been committed so there's nothing to restore
+            self._error('clone_rows: {0}'.format(str(ex).strip().split('\n')[0]), exception=ex)
+        # check whether or not the user is happy.. will backup if not
+        if self.user_happy():
+            # print restore SQL so the user can restore from SQL manually later if necessary
+            self.print_restore_sql()
+        # all done, cleanup and exit
+        self.exit()
+
+    def clone_dependencies(self):
+        """
+        clone the row(s) set up by parse_cla along with the rows linked to them by foreign keys,
+        to --dependencies levels, exits when done. Each table's rows are cloned by its own worker,
+        in the order the foreign keys require, all in a single target transaction
+        """
+        with self.metrics.phase('connect'):
+            self.set_connections()
+        with self.metrics.phase('get_rows'):
+            tables = self._get_dependencies()
+        logging.info('cloning %s tables in order: %s', len(tables), ', '.join(table for table, key, rows in tables))
+        self.workers = [self._get_dependency_worker(*table) for table in tables]
+        codes = [None] * len(self.workers)
+        with self.metrics.phase('tables'):
+            # one after another, they share our target connection
+            for i, worker in enumerate(self.workers):
+                codes[i] = worker._clone_target() # pylint: disable=locally-disabled,protected-access
+                if codes[i] not in [0, 5, 6]:
+                    break
+        rolled_back = bool([code for code in codes if code not in [None, 0, 5, 6]])
+        if rolled_back:
+            self.target['connection'].rollback()
+        else:
+            self.target['connection'].commit()
+        self._print_fan_out_summary(codes, rolled_back)
+        for worker, code in zip(self.workers, codes):
+            worker._write_metrics(1 if rolled_back else code) # pylint: disable=locally-disabled,protected-access
+        if not rolled_back and 0 in codes:
+            if self.user_happy():
+                self.print_restore_sql()
+        self.exit(1 if rolled_back else self._get_fan_out_code(codes))
+
+    @classmethod
+    def copy_config(cls, config):
+        """
+        return a copy of config for a single clone, parse_cla adds clone specific sections to it
+        so clones can't share one
+
+        Keyword arguments:
+        config -- the config, as returned by read_config
+        """
+        return copy.deepcopy(config)
+
     def exit(self, code=0):
         """ wrapper for exiting the script successfully """
+        # don't pull the connection out from under a backup that's still running
+        self._wait_for_unload()
+        self._save_watermark(code)
         logging.info('operation completed successfully, have a fantastic day')
         self._housekeep()
+        self._report_trace()
+        self._write_metrics(code)
         sys.exit(code)
 
+    def fan_out(self):
+        """
+        clone the row(s) set up by parse_cla from source to every target, exits when done.
+        The source is read once, then each target is diffed, backed up and updated concurrently
+        by its own worker. With --atomic, nothing is committed until every target has succeeded
+        """
+        self._start_log_shipper()
+        with self.metrics.phase('connect'):
+            self.source['connection'] = self._connect(self.source['alias'])
+        logging.info('reading %s once for %s targets..', self.source['alias'], len(self._get_target_aliases()))
+        with self.metrics.phase('check_plans'):
+            self._check_plans()
+        with self.metrics.phase('get_rows'):
+            if self.database['batch']:
+                self.source['rows'] = self._get_rows(self.source)
+            else:
+                self.source['row'] = self._get_row(self.source)
+            self._check_source_rows()
+            # workers never need to query the source for its metadata
+            self._get_metadata(self.source)
+        self.workers = [self._get_worker(alias) for alias in self._get_target_aliases()]
+        with self.metrics.phase('targets'):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.workers)) as executor:
+                codes = list(executor.map(CloneRow._clone_target, self.workers))
+        rolled_back = False
+        if self.config.getboolean('clone_row', 'atomic'):
+            # nothing to do counts as success, every target is now in line with the source
+            rolled_back = bool([code for code in codes if code not in [0, 5, 6]])
+            for worker, code in zip(self.workers, codes):
+                if code != 0:
+                    continue
+                if rolled_back:
+                    worker.target['connection'].rollback()
+                    worker._housekeep() # pylint: disable=locally-disabled,protected-access
+                else:
+                    worker.target['connection'].commit()
+        self._print_fan_out_summary(codes, rolled_back)
+        for worker, code in zip(self.workers, codes):
+            worker._write_metrics(1 if rolled_back else code) # pylint: disable=locally-disabled,protected-access
+        # only targets we've cloned to still have a connection, they're the ones to restore
+        if [worker for worker in self.workers if worker.target['connection'] is not None]:
+            if self.user_happy():
+                self.print_restore_sql()
+        self.exit(1 if rolled_back else self._get_fan_out_code(codes))
+
     def find_deltas(self):
         """ use DictDiffer to find differences between target and source databases """
+        self._start_unload()
         logging.info('finding deltas..')
-        delta = DictDiffer(self.source['row'], self.target['row'])
+        if not self.database['batch']:
+            self.database['deltas'] = self._get_deltas(self.source['row'], self.target['row'])
+            self._fetch_hashed_columns()
+            return
+        self.database['batch_deltas'] = dict(
+            (key, self._get_deltas(self.source['rows'][key], self.target['rows'][key]))
+            for key in self.database['keys']
+        )
+        # summarise the batch so schema updates and delta reporting work as for a single row
+        batch_deltas = list(self.database['batch_deltas'].values())
         self.database['deltas'] = {
-            'new_columns_in_source': delta.added(),
-            'new_columns_in_target': delta.removed(),
-            'delta_columns': delta.changed(),
-            'unchanged_columns': delta.unchanged()
+            'new_columns_in_source': batch_deltas[0]['new_columns_in_source'],
+            'new_columns_in_target': batch_deltas[0]['new_columns_in_target'],
+            'delta_columns': set().union(*[d['delta_columns'] for d in batch_deltas]),
+            'unchanged_columns': set.intersection(*[d['unchanged_columns'] for d in batch_deltas])
         }
+        self._fetch_hashed_columns()
+
+    def get_restore_sql(self):
+        """
+        return the sql steps to rollback by hand after script has run, one line per step.
+        With several targets, the steps of each target follow one another
+        """
+        if self.workers and not self.database['dependencies']:
+            restore_sql = []
+            for worker in self.workers:
+                if worker.target['connection'] is not None:
+                    restore_sql += worker.get_restore_sql()
+            return restore_sql
+        # cloning dependencies, every table is restored in the one transaction
+        if self.database['dependencies']:
+            clones = [worker for worker in self.workers if worker.target['backup_keys'] or worker.target['new_keys']]
+        else:
+            clones = [self]
+        target_alias = self.target['alias']
+        restore_sql = [
+            '    ./BackupStore.py {0} export {1} {2}'.format(
+                self.backup_store.directory, clone.target['backup_id'], clone.target['backup']
+            ) for clone in clones if clone.target['backup_id'] is not None
+        ]
+        restore_sql.append('    ' + self.target['connection'].get_connection_string({
+            'host': self.config.get('host.' + target_alias, 'hostname'),
+            'port': self.config.get('host.' + target_alias, 'port'),
+            'user': self.config.get('host.' + target_alias, 'username'),
+            'database': self.target['db_name']
+        }))
+        restore_sql.append('    begin;')
+        # rows have to be deleted before the rows they reference, and loaded after them
+        for clone in reversed(clones):
+            restore_sql += clone._get_restore_delete_sql() # pylint: disable=locally-disabled,protected-access
+        for clone in clones:
+            if clone.target['backup'] is not None:
+                restore_sql.append('    ' + self.target['connection'].get_load_sql(
+                    clone.target['backup'], clone.database['table']
+                ))
+        restore_sql.append('    commit;')
+        return restore_sql
 
     def get_rows(self):
         """ get a single row from soure and target databases """
-        self.source['row'] = self._get_row(self.source)
-        self.target['row'] = self._get_row(self.target)
-        # we really need a source row..
-        if self.source['row'] is None:
-            self._error('get_rows: no row found in {0} database - query details (table , column, filter) {1} {2} {3}'.format(self.source['alias'], self.database['table'], self.database['column'], self.database['filter']))
+        if self.database['batch']:
+            return self._get_batch_rows()
+        with self.metrics.phase('check_plans'):
+            self._check_plans()
+        if self.parent is not None:
+            # the source row has already been read once for every target
+            self.target['row'] = self._get_row(self.target)
+        else:
+            self.source['row'], self.target['row'] = self._run_concurrently(
+                (self._get_row, self.source), (self._get_row, self.target)
+            )
+            # we really need a source row..
+            self._check_source_rows()
         # make sure the encoding is all good
-        self._check_encoding()
+        with self.metrics.phase('check_encoding'):
+            self._check_encoding()
 
     def insert_target(self):
         """
         insert as little data as possible into the target database, if nothing
         exists there already. This allows us to reselect and continue as normal
         """
+        if self.database['batch']:
+            return self._insert_batch_target()
         if self.target['row'] is not None:
             # we only need to do this if there's no target row
             return
 
-        columns = self.target['connection'].get_mandatory_columns(self.database['table'])
+        columns = self._get_mandatory_columns()
         columns.append(self.database['column'])
         columns = set(columns)
         values = []
@@ -472,8 +1764,13 @@ class CloneRow(object):
         self.target['row'] = self._get_row(self.target)
         self.target['new_insert'] = True
 
-    def parse_cla(self):
-        """ parse command line arguments and setup config based on them """
+    def parse_cla(self, argv=None):
+        """
+        parse command line arguments and setup config based on them
+
+        Keyword arguments:
+        argv -- list of arguments to parse instead of sys.argv
+        """
         parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
         aliases = [section for section in self.config.sections() if 'host.' in section]
         parser.add_argument(
@@ -493,6 +1790,104 @@ class CloneRow(object):
             help='do not prompt the user to restore, backup SQL will still be logged',
             default=False
         )
+        parser.add_argument(
+            '--filter_file', '-F',
+            help='file of values to filter column on, one per line (batch mode)',
+            default=None
+        )
+        parser.add_argument(
+            '--range', '-r',
+            nargs=2,
+            metavar=('LOW', 'HIGH'),
+            help='clone every row where column between LOW and HIGH (batch mode)',
+            default=None
+        )
+        parser.add_argument(
+            '--table_sync', '-t',
+            action='store_true',
+            help='clone every row of the table which differs, walking it on column (batch mode)',
+            default=False
+        )
+        parser.add_argument(
+            '--incremental', '-i',
+            action='store_true',
+            help='clone every row changed since the last successful clone to the target, found ' +
+            'on the table\'s watermark_column (batch mode)',
+            default=False
+        )
+        parser.add_argument(
+            '--chunk_size', '-c',
+            type=int,
+            help='number of rows per checksummed chunk when running with --table_sync',
+            default=1000
+        )
+        parser.add_argument(
+            '--itersize',
+            type=int,
+            help='rows fetched per round trip when streaming rows (batch mode and backups)',
+            default=1000
+        )
+        parser.add_argument(
+            '--hash_large_columns', '-H',
+            action='store_true',
+            help='compare large (blob, text, json) columns by server side md5, ' +
+            'only transferring values which differ',
+            default=False
+        )
+        parser.add_argument(
+            '--bulk_threshold', '-b',
+            type=int,
+            help='in batch mode, bulk apply updates to at least this many rows changing the ' +
+            'same columns (0 to disable)',
+            default=100
+        )
+        parser.add_argument(
+            '--scan_threshold',
+            type=int,
+            help='refuse to clone if looking the row(s) up on source or target would read more ' +
+            'than this many rows without an index, see EXPLAIN (0 to disable)',
+            default=10000
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='clone even if looking the row(s) up would read more than --scan_threshold rows',
+            default=False
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            help='retry the clone this many times, with backoff, if the target hits a deadlock ' +
+            'or serialization failure',
+            default=3
+        )
+        parser.add_argument(
+            '--atomic', '-a',
+            action='store_true',
+            help='with several targets, only commit to any of them once every target has ' +
+            'been updated successfully',
+            default=False
+        )
+        parser.add_argument(
+            '--dependencies', '-d',
+            type=int,
+            metavar='DEPTH',
+            help='also clone rows linked to the row(s) by foreign keys (referenced rows and rows ' +
+            'referencing them), following links DEPTH levels deep, all in a single transaction',
+            default=0
+        )
+        parser.add_argument(
+            '--trace', '-T',
+            type=int,
+            metavar='N',
+            help='trace every sql statement run, logging the N slowest (by total time) at exit',
+            default=0
+        )
+        parser.add_argument(
+            '--trace_file',
+            help='trace every sql statement run, appending each to this file as a json line',
+            default=None
+        )
         parser.add_argument(
             'source_alias',
             help='source host alias (for host.* config section)',
@@ -500,61 +1895,114 @@ class CloneRow(object):
         )
         parser.add_argument(
             'target_alias',
-            help='target host alias (for host.* section)',
-            choices=[alias[5:] for alias in aliases]
+            help='target host alias (for host.* section), comma separate several aliases ' +
+            'to clone to each of them at once: {' + ','.join(alias[5:] for alias in aliases) + '}'
+        )
+        parser.add_argument(
+            'table',
+            help='table to consider: select from <table>, with --schema_only a glob of ' +
+            'tables, e.g. \'*\' for every table'
         )
-        parser.add_argument('table', help='table to consider: select from <table>')
         parser.add_argument('column', nargs='?', help='column to consider')
         parser.add_argument(
             'filter',
-            nargs='?',
-            help='value to filter column: where column = <filter>'
+            nargs='*',
+            help='value(s) to filter column: where column = <filter>, ' +
+            'more than one value clones every row in a single batch'
         )
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
+        keys = list(args.filter)
+        if args.filter_file is not None:
+            keys += self._read_filter_file(args.filter_file)
         # we either need --schema_only or column AND filter passed in
-        if not args.schema_only and (args.column is None or args.filter is None):
+        if not args.schema_only and (
+                args.column is None or
+                (not keys and args.range is None and not args.table_sync and not args.incremental)):
             print('\ncolumn & filter arguments must be supplied unless running with --schema_only/-s\n')
             parser.print_help()
             sys.exit(2)
+        if len([mode for mode in [keys, args.range, args.table_sync, args.incremental] if mode]) > 1:
+            print('\n--range, --table_sync and --incremental cannot be combined with each other or filter values\n')
+            parser.print_help()
+            sys.exit(2)
+        targets = args.target_alias.split(',')
+        for target in targets:
+            if 'host.' + target not in aliases:
+                parser.error('invalid target alias: {0}'.format(target))
+        if len(targets) > 1 and (args.table_sync or args.incremental):
+            print('\n--table_sync and --incremental cannot be run against several targets at once\n')
+            parser.print_help()
+            sys.exit(2)
+        if args.dependencies and (len(targets) > 1 or args.schema_only or args.range is not None or
+                                  args.table_sync or args.incremental or args.hash_large_columns):
+            print('\n--dependencies cannot be combined with several targets, --schema_only, --range, ' +
+                  '--table_sync, --incremental or --hash_large_columns\n')
+            parser.print_help()
+            sys.exit(2)
         self.source['alias'] = args.source_alias
-        self.target['alias'] = args.target_alias
-        if self.source['alias'] == self.target['alias']:
+        self.target['alias'] = targets[0]
+        if self.source['alias'] in targets:
             self._error('source and target alias are identical')
+        if len(set(targets)) != len(targets):
+            self._error('the same target alias is given more than once')
         self.source['db_name'] = self.config.get('host.' + args.source_alias, 'database')
-        self.target['db_name'] = self.config.get('host.' + args.target_alias, 'database')
+        self.target['db_name'] = self.config.get('host.' + self.target['alias'], 'database')
         self.database['table'] = args.table
+        self.database['table_glob'] = bool(set(args.table) & set('*?['))
+        if self.database['table_glob'] and not args.schema_only:
+            print('\na table glob can only be used with --schema_only/-s\n')
+            parser.print_help()
+            sys.exit(2)
         self.database['column'] = args.column
-        self.database['filter'] = args.filter
-        self._get_table_config(self.database['table'])
+        if len(keys) == 1 and args.range is None:
+            self.database['filter'] = keys[0]
+        elif not args.schema_only:
+            self.database['batch'] = True
+            # drop duplicates, preserving the order they were given in
+            self.database['keys'] = sorted(set(keys), key=keys.index) if keys else None
+            self.database['range'] = args.range
+            self.database['table_sync'] = args.table_sync
+            self.database['incremental'] = args.incremental
+        self.database['dependencies'] = args.dependencies
+        if not self.database['table_glob']:
+            self._get_table_config(self.database['table'])
+        if self.database['incremental']:
+            if self.database['watermark_column'] is None:
+                logging.error('--incremental needs a watermark_column in [table.%s] in CloneRow.cfg',
+                              self.database['table'])
+                sys.exit(3)
+            self.watermark_store = WatermarkStore(
+                self.config.get('watermarks', 'directory', fallback='~/.clone-row/watermarks')
+            )
         self.config.add_section('clone_row')
         self.config.set('clone_row', 'unload_dir', args.unload_dir)
         self.config.set('clone_row', 'dump_filepath', self._get_dump_filepath())
         self.config.set('clone_row', 'schema_only', str(args.schema_only))
         self.config.set('clone_row', 'feeling_lucky', str(args.feeling_lucky))
+        self.config.set('clone_row', 'chunk_size', str(args.chunk_size))
+        self.config.set('clone_row', 'itersize', str(args.itersize))
+        self.config.set('clone_row', 'hash_large_columns', str(args.hash_large_columns))
+        self.config.set('clone_row', 'bulk_threshold', str(args.bulk_threshold))
+        self.config.set('clone_row', 'targets', ','.join(targets))
+        self.config.set('clone_row', 'scan_threshold', str(args.scan_threshold))
+        self.config.set('clone_row', 'force', str(args.force))
+        self.config.set('clone_row', 'retries', str(args.retries))
+        self.config.set('clone_row', 'atomic', str(args.atomic))
+        self.config.set('clone_row', 'trace', str(args.trace))
+        self.config.set('clone_row', 'trace_file', args.trace_file)
+        if args.trace or args.trace_file is not None:
+            self.tracer = SqlTracer()
 
     def print_restore_sql(self):
         """ provide sql steps to rollback by hand after script has run """
-        target_alias = self.target['alias']
-        restore_sql = [
-            '    ' + self.target['connection'].get_connection_string({
-                'host': self.config.get('host.' + target_alias, 'hostname'),
-                'port': self.config.get('host.' + target_alias, 'port'),
-                'user': self.config.get('host.' + target_alias, 'username'),
-                'database': self.target['db_name']
-            })
-        ]
-        restore_sql.append('    begin;')
-        restore_sql.append('    delete from {0} where {1} = {2};'.format(
-            self.database['table'],
-            self.database['column'],
-            self._quote_sql_param(self.database['filter'])
-        ))
-        restore_sql.append('    -- if more than one row has been deleted above run `rollback;`')
-        if not self.target['new_insert']:
-            restore_sql.append('    ' + self.target['connection'].get_load_sql(
-                self.target['backup'], self.database['table']
-            ))
-        restore_sql.append('    commit;')
+        if self.workers and not self.database['dependencies']:
+            for worker in self.workers:
+                if worker.target['connection'] is not None:
+                    worker.print_restore_sql()
+            return
+        restore_sql = self.get_restore_sql()
+        # kept for callers running several clones, the connection is gone by the time they look
+        self.target['restore_sql'] = restore_sql
         logging.info('')
         logging.info(self._get_log_break('|Manual Rollback Steps|'))
         logging.info('  To rollback manually, run the following steps on this machine')
@@ -564,47 +2012,82 @@ class CloneRow(object):
         logging.info('')
         return
 
+    @classmethod
+    def read_config(cls):
+        """ read and return CloneRow.cfg, setting up logging on the way """
+        # make sure the config file has correct permissions (0600)
+        cls._check_config_chmod()
+        if sys.stderr.isatty():
+            # colours are only any use to a human, don't pay for importing them in scripts
+            import coloredlogs # pylint: disable=locally-disabled,import-outside-toplevel
+            coloredlogs.install(show_hostname=False, show_name=False, show_severity=False)
+        else:
+            logging.basicConfig(
+                level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S',
+                format='%(asctime)s %(name)s[%(process)d] %(levelname)s %(message)s'
+            )
+        logging.info('Reading configuration..')
+        config = configparser.ConfigParser(allow_no_value=True)
+        try:
+            config.readfp(open(os.path.dirname(os.path.realpath(__file__)) + '/CloneRow.cfg'))
+        except IOError:
+            logging.error('You have not setup a CloneRow.cfg file for your requirements')
+            logging.info('take a look at CloneRow.example.cfg')
+            logging.info('https://github.com/lathonez/mysql-clone-row#configuration')
+            sys.exit(3)
+        return config
+
+    def scan_schema(self):
+        """
+        report schema differences between the source and each target, for every table
+        matching the table glob, exits when done. Each host's catalog is read in a single
+        query, every host at once, and diffed in memory
+        """
+        self.workers = [self._get_worker(alias) for alias in self._get_target_aliases()]
+        hosts = [self.source] + [worker.target for worker in self.workers]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            catalogs = list(executor.map(self._get_catalog, hosts))
+        logging.info('%s tables match %s in %s', len(catalogs[0]), self.database['table'], self.source['alias'])
+        summary = []
+        for worker, catalog in zip(self.workers, catalogs[1:]):
+            changes = self._print_schema_drift(catalogs[0], worker.target, catalog)
+            summary.append((worker.target['alias'], changes))
+        for target_alias, changes in summary:
+            logging.info('%s schema differences between %s and %s', changes, self.source['alias'], target_alias)
+        self.exit()
+
     def set_connections(self):
         """ setup soure and target MySQLdb.connection objects """
-        self.source['connection'] = self._connect(self.source['alias'])
-        self.target['connection'] = self._connect(self.target['alias'])
+        self._start_log_shipper()
+        self.source['connection'], self.target['connection'] = self._run_concurrently(
+            (self._connect, self.source['alias']), (self._connect, self.target['alias'])
+        )
         # we don't want mysql commit stuff unless we've okay'd it
         self.target['connection'].autocommit(False)
 
     def show_schema_updates(self):
         """ display SQL statements to adjust database for schema differences on this table """
+        if self.database['deltas']['new_columns_in_target']:
+            # we're going to query the target, make sure the backup has finished with it
+            self._wait_for_unload()
         for mode in ['source', 'target']:
             deltas = self.database['deltas']['new_columns_in_' + mode]
             working_db = self.source['alias'] if mode == 'source' else self.target['alias']
             other_db = self.target['alias'] if mode == 'source' else self.source['alias']
-            con = self.source['connection'] \
-                if working_db == self.source['alias'] else self.target['connection']
+            host = self.source if working_db == self.source['alias'] else self.target
+            columns = dict((c['name'], c) for c in self._get_metadata(host)['columns'])
             for column in deltas:
-                logging.info('')
-                logging.info(self._get_log_break('|Schema Change - Column: {0}|'.format(column)))
-                logging.info(
-                    '  Column \'%s\' exists in the %s database but not in %s',
-                    column, working_db, other_db
+                self._print_column_sql(
+                    host['connection'], self.database['table'], columns[column], working_db, other_db
                 )
-                info = con.get_column_sql(self.database['table'], column)
-                logging.info(
-                    '  To Add Column \'%s\' to %s, run the following SQL on %s:',
-                    column, other_db, other_db
-                )
-                logging.warning('    ' + info['add_sql'])
-                logging.info(
-                    '  To Drop Column \'%s\' from %s, run the following SQL on %s:',
-                    column, working_db, working_db
-                )
-                logging.warning('    ' + info['drop_sql'])
-                logging.info(self._get_log_break())
-                logging.info('')
         if self.config.getboolean('clone_row', 'schema_only'):
             # we're done if only diffing schema
             self.exit()
 
     def update_target(self):
         """ apply differences in the source database to the target """
+        if self.database['batch']:
+            return self._update_batch_target()
         delta_columns = self.database['deltas']['delta_columns']
         if not len(delta_columns):
             logging.warning('data is identical in target and source, nothing to do..')
@@ -614,15 +2097,14 @@ class CloneRow(object):
             logging.warning('all changes are configured to be ignored, nothing to do..')
             self.exit(6)
         self._print_delta_columns(delta_columns)
-        if not self.target['new_insert']:
-            self.target['backup'] = self._unload_target()
-        else:
-            logging.info('not backing up target on new insert..')
+        self._wait_for_unload()
         cur = self.target['connection'].cursor()
         update_sql = None
         update_params = []
         # generate update sql for everything in the deltas
         columns = [c for c in delta_columns if c not in self.database['ignore_columns']]
+        self.metrics.count('columns_changed', len(columns))
+        self.metrics.count('rows_changed')
         for column in columns:
             if not update_sql:
                 update_sql = 'update "{0}" set "{1}" = %s'.format(self.database['table'], column)
@@ -631,17 +2113,17 @@ class CloneRow(object):
             update_params.append(self.target['connection'].adapt_param(self.source['row'][column]))
         update_sql += ' where {0} = %s'.format(self.database['column'])
         update_params.append(self.database['filter'])
-        # run the update
-        cur.execute(update_sql, tuple(update_params))
+        # run the update, prepared as it's reused for every row changing the same columns
+        self.target['connection'].execute_prepared(cur, update_sql, tuple(update_params))
         # dump the actual update sql out to disk so we can look at it later if necessary
-        self._dump_update_sql(self.target['connection'].get_last_executed(cur))
+        self._dump_update_sql(self.target['connection'].mogrify(update_sql, tuple(update_params)))
         if self.target['connection'].affected_rows(cur) != 1:
             self.target['connection'].rollback()
             cur.close()
             self._error('update_target: expected to update a single row')
         # don't commit anything until all updates have gone in ok
         cur.close()
-        self.target['connection'].commit()
+        self._commit_target()
         return
 
     def user_happy(self):
@@ -651,10 +2133,14 @@ class CloneRow(object):
             logging.warning('Not prompting to restore from backup as you\'re felling lucky today')
             return True
         logging.warning('Type \'r\' to (r)estore from backup, anything else to exit')
-        descision = input()
+        with self.metrics.phase('prompt'):
+            descision = input()
         if descision == 'r':
             logging.warning('restoring from backup..')
-            self._restore_target()
+            with self.metrics.phase('restore_target'):
+                self._restore_target()
+            # the rows changed since the last clone have to be cloned again next time
+            self.database['watermark'] = None
             return False
         return True
 
@@ -662,24 +2148,10 @@ class CloneRow(object):
 #   main execution path
 #   https://en.wikipedia.org/wiki/Dolly_(sheep)
 #
-DOLLY = CloneRow()
-# parse command line arguments from the user
-DOLLY.parse_cla()
-# establish a connection to source and target databases
-DOLLY.set_connections()
-# grab a single row from both databases
-DOLLY.get_rows()
-# if no row exists in the target, insert it here
-DOLLY.insert_target()
-# find differences between source and target
-DOLLY.find_deltas()
-# display SQL updates to bring source and target table definitions in-line
-DOLLY.show_schema_updates()
-# update the target database (and back it up)
-DOLLY.update_target()
-# check whether or not the user is happy.. will backup if not
-if DOLLY.user_happy():
-    # print restore SQL so the user can restore from SQL manually later if necessary
-    DOLLY.print_restore_sql()
-# all done, cleanup and exit
-DOLLY.exit()
+if __name__ == '__main__':
+    DOLLY = CloneRow()
+    # parse command line arguments from the user
+    DOLLY.parse_cla()
+    DOLLY.metrics.add('startup', time.perf_counter() - STARTED)
+    # clone the row, exiting when done
+    DOLLY.clone()
@@ -0,0 +1,80 @@
+""" Pool of warm PDBC connections, keyed on host alias """
+
+# standard imports
+import logging
+import threading
+
+class ConnectionPool(object):
+    """ ConnectionPool constructor """
+
+    def __init__(self, max_idle=4):
+        """
+        Keyword arguments:
+        max_idle -- the maximum number of idle connections kept per host alias
+        """
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    #
+    # PRIVATE methods
+    #
+
+    @classmethod
+    def _discard(cls, pdbc):
+        """ close a connection we no longer want, ignoring any errors doing so """
+        try:
+            pdbc.close()
+        except Exception: # pylint: disable=locally-disabled,broad-except
+            pass
+
+    #
+    # PUBLIC methods
+    #
+
+    def close(self):
+        """ close every idle connection in the pool """
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for pdbc in connections:
+                self._discard(pdbc)
+
+    def get(self, host_alias):
+        """
+        return a validated idle connection to host_alias, or None if there isn't one
+
+        Keyword arguments:
+        host_alias -- the configured alias of the host, e.g. local (host.local in config)
+        """
+        while True:
+            with self.lock:
+                connections = self.idle.get(host_alias, [])
+                if not connections:
+                    return None
+                pdbc = connections.pop()
+            if pdbc.ping():
+                return pdbc
+            logging.info('discarding stale pooled connection to %s', host_alias)
+            self._discard(pdbc)
+
+    def put(self, host_alias, pdbc):
+        """
+        return a connection to the pool, ending any transaction left open on it
+
+        Keyword arguments:
+        host_alias -- the configured alias of the host the connection is to
+        pdbc -- the PDBC object
+        """
+        try:
+            pdbc.rollback()
+        except Exception: # pylint: disable=locally-disabled,broad-except
+            self._discard(pdbc)
+            return
+        with self.lock:
+            connections = self.idle.setdefault(host_alias, [])
+            if len(connections) < self.max_idle:
+                connections.append(pdbc)
+                return
+        self._discard(pdbc)
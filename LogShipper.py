@@ -0,0 +1,155 @@
+""" Background shipping of transaction logs (backups and update sql) to a remote log server """
+
+# standard imports
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+
+# external imports
+import paramiko
+
+class LogShipper(object):
+    """ LogShipper constructor """
+
+    def __init__(self, host, directory, spool_dir, max_backoff=60):
+        """
+        Keyword arguments:
+        host -- hostname of remote machine
+        directory -- directory on remote machine
+        spool_dir -- local directory files are compressed into and kept in until shipped
+        max_backoff -- maximum number of seconds to wait between retries
+        """
+        self.host = host
+        self.directory = directory
+        self.spool_dir = os.path.expanduser(spool_dir)
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue()
+        self.stopping = threading.Event()
+        self.ssh = None
+        self.sftp = None
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir, 0o700)
+        # anything left in the spool didn't make it last time, ship it with everything else
+        for filename in sorted(os.listdir(self.spool_dir)):
+            if filename.endswith('.gz'):
+                self.queue.put(os.path.join(self.spool_dir, filename))
+        self.thread = threading.Thread(target=self._run, name='LogShipper', daemon=True)
+        self.thread.start()
+
+    #
+    # PRIVATE methods
+    #
+
+    def _connect(self):
+        """ open the ssh and sftp session to the log server, we reuse it for every file """
+        logging.info('connecting to transaction log server %s..', self.host)
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.load_host_keys(os.path.expanduser(os.path.join('~', '.ssh', 'known_hosts')))
+        ssh_config_path = os.path.expanduser(os.path.join('~', '.ssh', 'config'))
+
+        if os.path.exists(ssh_config_path):
+            config = paramiko.SSHConfig()
+            config.parse(open(ssh_config_path))
+            ssh_config = config.lookup(self.host)
+        else:
+            ssh_config = {}
+
+        connect_options = {'hostname': self.host}
+
+        for key in ssh_config:
+            if key == 'identityfile':
+                connect_options['key_filename'] = ssh_config[key]
+            elif key == 'port':
+                connect_options[key] = int(ssh_config[key])
+            elif key == 'proxycommand':
+                connect_options['sock'] = paramiko.ProxyCommand(ssh_config[key])
+            elif key == 'user':
+                connect_options['username'] = ssh_config[key]
+            else:
+                connect_options[key] = ssh_config[key]
+
+        ssh.connect(**connect_options)
+        self.ssh = ssh
+        self.sftp = ssh.open_sftp()
+
+    def _disconnect(self):
+        """ close the session to the log server, if any """
+        if self.ssh is not None:
+            self.ssh.close()
+        self.ssh = None
+        self.sftp = None
+
+    def _run(self):
+        """ ship spooled files in batches until stopped and the queue is empty """
+        backoff = 1
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # ship whatever else has been queued up in the same session
+            while not self.queue.empty():
+                batch.append(self.queue.get())
+            try:
+                self._ship(batch)
+                backoff = 1
+            except Exception as ex: # pylint: disable=locally-disabled,broad-except
+                logging.warning('failed to ship transaction logs: %s', ex)
+                self._disconnect()
+                if self.stopping.is_set():
+                    # don't hold up the exit, it's all still in the spool for next time
+                    break
+                logging.info('retrying in %ss..', backoff)
+                for spooled in batch:
+                    if os.path.exists(spooled):
+                        self.queue.put(spooled)
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self._disconnect()
+
+    def _ship(self, batch):
+        """ upload a batch of spooled files, removing each from the spool once it's shipped """
+        if self.sftp is None:
+            self._connect()
+        for spooled in batch:
+            remote_path = os.path.join(self.directory, os.path.basename(spooled))
+            logging.info('shipping %s to %s:%s', spooled, self.host, remote_path)
+            self.sftp.put(spooled, remote_path)
+            os.remove(spooled)
+
+    #
+    # PUBLIC methods
+    #
+
+    def close(self, timeout):
+        """
+        stop shipping once the queue is empty, waiting at most timeout seconds for it to empty.
+        Anything not shipped by then stays in the spool and is shipped by the next LogShipper
+
+        Keyword arguments:
+        timeout -- maximum number of seconds to wait
+        """
+        self.stopping.set()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.warning(
+                'transaction logs not shipped yet will be shipped next time, see %s', self.spool_dir
+            )
+
+    def ship(self, filepath):
+        """
+        compress a local file into the spool and queue it to be shipped in the background
+
+        Keyword arguments:
+        filepath: path to local file
+        """
+        spooled = os.path.join(self.spool_dir, os.path.basename(filepath) + '.gz')
+        # compress to a temporary name, the spool only ever contains complete files
+        with open(filepath, 'rb') as infile, gzip.open(spooled + '.tmp', 'wb') as outfile:
+            shutil.copyfileobj(infile, outfile)
+        os.replace(spooled + '.tmp', spooled)
+        self.queue.put(spooled)
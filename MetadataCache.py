@@ -0,0 +1,108 @@
+""" On disk cache of table metadata and lookup plans, invalidated by a fingerprint of the table's ddl """
+
+# standard imports
+import json
+import logging
+import os
+import tempfile
+
+class MetadataCache(object):
+    """ MetadataCache constructor """
+
+    def __init__(self, directory):
+        """
+        Keyword arguments:
+        directory -- directory to keep cache files in, created if it doesn't exist
+        """
+        self.directory = os.path.expanduser(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+
+    #
+    # PRIVATE methods
+    #
+
+    def _get_path(self, host_alias, table):
+        """ return the path of the cache file for a table on a host alias """
+        return os.path.join(self.directory, '{0}.{1}.json'.format(host_alias, table))
+
+    def _read(self, host_alias, table):
+        """ return the cache file for a table on a host alias, or None if there isn't one """
+        try:
+            with open(self._get_path(host_alias, table)) as handle:
+                return json.load(handle)
+        except (IOError, ValueError):
+            return None
+
+    def _write(self, host_alias, table, cached):
+        """ write the cache file for a table on a host alias """
+        # write and rename, so concurrent runs never read half a file
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as tmp_file:
+            json.dump(cached, tmp_file)
+        os.replace(tmp_path, self._get_path(host_alias, table))
+
+    #
+    # PUBLIC methods
+    #
+
+    def get(self, host_alias, pdbc, database, table):
+        """
+        return metadata for table (see PDBC.get_table_metadata), only querying
+        the catalog if the table's fingerprint has changed since it was cached
+
+        Keyword arguments:
+        host_alias -- the configured alias of the host, e.g. local (host.local in config)
+        pdbc -- PDBC connection to the host
+        database -- name of the database on the host
+        table -- the table
+        """
+        fingerprint = pdbc.get_fingerprint(database, table)
+        cached = self._read(host_alias, table)
+        if cached is None or cached['fingerprint'] != fingerprint:
+            cached = {'fingerprint': fingerprint}
+        if fingerprint is not None and 'metadata' in cached:
+            logging.info('using cached metadata for %s on %s', table, host_alias)
+            return cached['metadata']
+        cached['metadata'] = pdbc.get_table_metadata(database, table)
+        if fingerprint is not None:
+            self._write(host_alias, table, cached)
+        return cached['metadata']
+
+    def get_plan(self, host_alias, pdbc, database, table, column):
+        """
+        return the cached plan (see PDBC.explain) of looking a row up on a column of table,
+        or None if there isn't one or the table's fingerprint has changed since it was cached
+
+        Keyword arguments:
+        host_alias -- the configured alias of the host, e.g. local (host.local in config)
+        pdbc -- PDBC connection to the host
+        database -- name of the database on the host
+        table -- the table
+        column -- the column rows are looked up on
+        """
+        cached = self._read(host_alias, table)
+        if cached is None or cached['fingerprint'] != pdbc.get_fingerprint(database, table):
+            return None
+        return cached.get('plans', {}).get(column)
+
+    def put_plan(self, host_alias, pdbc, database, table, column, plan):
+        """
+        cache the plan of looking a row up on a column of table, until the table's fingerprint changes
+
+        Keyword arguments:
+        host_alias -- the configured alias of the host, e.g. local (host.local in config)
+        pdbc -- PDBC connection to the host
+        database -- name of the database on the host
+        table -- the table
+        column -- the column rows are looked up on
+        plan -- as returned by PDBC.explain
+        """
+        fingerprint = pdbc.get_fingerprint(database, table)
+        if fingerprint is None:
+            return
+        cached = self._read(host_alias, table)
+        if cached is None or cached['fingerprint'] != fingerprint:
+            cached = {'fingerprint': fingerprint}
+        cached.setdefault('plans', {})[column] = plan
+        self._write(host_alias, table, cached)
@@ -0,0 +1,145 @@
+""" Timings of each phase of a clone and counters, written as json lines and prometheus textfiles """
+
+# standard imports
+import contextlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+class Metrics(object):
+    """ Metrics constructor """
+
+    def __init__(self, jsonl_file=None, textfile_dir=None):
+        """
+        Keyword arguments:
+        jsonl_file -- file to append a json line describing each run to, if any
+        textfile_dir -- directory to write a prometheus textfile collector file to, if any
+        """
+        self.jsonl_file = os.path.expanduser(jsonl_file) if jsonl_file else None
+        self.textfile_dir = os.path.expanduser(textfile_dir) if textfile_dir else None
+        self.phases = {}
+        self.running = {}
+        self.counters = {}
+        self.written = False
+        # phases may be timed from the background backup
+        self.lock = threading.Lock()
+
+    #
+    # PRIVATE methods
+    #
+
+    @classmethod
+    def _get_label_string(cls, labels):
+        """ return labels in prometheus exposition format, e.g. {source="a",target="b"} """
+        return '{' + ','.join(
+            '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for key, value in sorted(labels.items())
+        ) + '}'
+
+    def _get_phases(self):
+        """ return seconds spent in each phase, including time so far in any still running """
+        now = time.perf_counter()
+        with self.lock:
+            phases = dict(self.phases)
+            for name, started in self.running.items():
+                phases[name] = phases.get(name, 0) + now - started
+        return phases
+
+    def _write_textfile(self, labels, code, phases):
+        """ write the run out for the prometheus node exporter's textfile collector """
+        lines = [
+            '# HELP clone_row_phase_seconds seconds spent in each phase of the last clone',
+            '# TYPE clone_row_phase_seconds gauge'
+        ]
+        for name, seconds in sorted(phases.items()):
+            lines.append('clone_row_phase_seconds{0} {1}'.format(
+                Metrics._get_label_string(dict(labels, phase=name)), seconds
+            ))
+        gauges = [(name, value) for name, value in sorted(self.counters.items())] + [
+            ('exit_code', code),
+            ('last_run_timestamp_seconds', time.time())
+        ]
+        for name, value in gauges:
+            lines.append('# TYPE clone_row_{0} gauge'.format(name))
+            lines.append('clone_row_{0}{1} {2}'.format(name, Metrics._get_label_string(labels), value))
+        # the collector reads *.prom, so write under another name and rename
+        filename = re.sub(r'[^A-Za-z0-9_.-]', '_', 'clone_row-{source}-{target}-{table}'.format(**labels))
+        handle, tmp_path = tempfile.mkstemp(dir=self.textfile_dir, suffix='.tmp')
+        with os.fdopen(handle, 'w') as tmp_file:
+            tmp_file.write('\n'.join(lines) + '\n')
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(self.textfile_dir, filename + '.prom'))
+
+    #
+    # PUBLIC methods
+    #
+
+    def add(self, name, seconds):
+        """
+        add time spent in a phase timed elsewhere, e.g. startup, before we existed
+
+        Keyword arguments:
+        name -- the phase
+        seconds -- the time spent in it
+        """
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def count(self, name, value=1):
+        """
+        add to a counter
+
+        Keyword arguments:
+        name -- the counter, e.g. rows_read
+        value -- the amount to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        time a phase of the clone, e.g. with metrics.phase('get_rows'): ..
+        a phase entered more than once is timed in total
+
+        Keyword arguments:
+        name -- the phase
+        """
+        with self.lock:
+            self.running[name] = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                started = self.running.pop(name)
+                self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - started
+
+    def write(self, labels, code):
+        """
+        write the timings and counters of this run to wherever is configured, once
+
+        Keyword arguments:
+        labels -- dict describing the run: source, target, table
+        code -- the code we're exiting with
+        """
+        if self.written:
+            return
+        self.written = True
+        phases = self._get_phases()
+        if self.jsonl_file is not None:
+            line = json.dumps(dict(
+                labels, time=time.strftime('%Y-%m-%dT%H:%M:%S%z'), code=code,
+                phases=phases, counters=self.counters
+            ))
+            with open(self.jsonl_file, 'a') as handle:
+                handle.write(line + '\n')
+        if self.textfile_dir is not None:
+            if not os.path.isdir(self.textfile_dir):
+                # it belongs to the node exporter, it's not for us to create it
+                logging.warning('metrics textfile_dir %s does not exist, not writing metrics', self.textfile_dir)
+                return
+            self._write_textfile(labels, code, phases)
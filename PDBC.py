@@ -1,55 +1,92 @@
-""" Connection wrapper for MySQLdb and psycopg2 """
+""" Connection wrapper for MySQLdb and psycopg2, see PDBCMysql and PDBCPostgres """
 
 # internal imports
-from subprocess import Popen
-
-# external imports
-import MySQLdb
-import psycopg2        # pylint: disable=locally-disabled,import-error
-import psycopg2.extras # pylint: disable=locally-disabled,import-error
+import datetime
+import hashlib
+import importlib
+import json
+import logging
+import os
+import re
+import time
 
 class PDBC(object):
-    """ PDBC constructor """
+    """
+    PDBC constructor, PDBC(driver) returns a connection wrapper of the backend for driver.
+    Each backend subclasses PDBC in its own module, implementing whatever differs between drivers
+    """
+
+    # backend module (and class) by the driver configured for a host alias. A backend, and so
+    # its driver, is only imported once a host alias using it is connected to, see register
+    BACKENDS = {
+        'mysql': 'PDBCMysql',
+        'psql': 'PDBCPostgres'
+    }
+
+    # set by each backend
+    driver = None
+    large_types = []
+    quote = '"'
 
     #
     # PRIVATE methods
     #
 
-    def __init__(self, driver):
+    def __new__(cls, driver=None):
+        if cls is PDBC:
+            cls = PDBC.get_backend(driver)
+        return super(PDBC, cls).__new__(cls)
+
+    def __init__(self, driver=None): # pylint: disable=locally-disabled,unused-argument
         self.con = None
-        self.driver = PDBC._get_driver(driver)
+        self.tracer = None
+        self.host_alias = None
+        # server side prepared statements on this connection, by the sql they were prepared from
+        self.prepared = {}
+        # rows fetched per round trip by stream_query
+        self.itersize = 1000
 
-    def _is_postgres(self):
+    def _dump_rows(self, cur, select_sql, param, args):
         """
-        return true if this instance is running against postgres
+        dump the rows select_sql selects to args['dump_file'], returning the DumpWriter written to
         """
-        return self.driver == PDBC._get_driver('psql')
+        raise NotImplementedError
 
-    @classmethod
-    def _get_driver(cls, driver):
-        return {
-            'mysql': MySQLdb,
-            'psql': psycopg2,
-        }.get(driver)
+    def _get_catalog_sql(self, table):
+        """
+        return sql selecting the columns of every table (or just table) in the database as
+            table, column, type, column_type, nullable, default, primary key, auto increment
+        """
+        raise NotImplementedError
 
-    @classmethod
-    def _map_connect_args(cls, args):
+    def _get_checksum_sql(self, row_hash, column):
         """
-        map connect args from mysql to psql
-        db -> database
-        passwd -> password
+        return an sql aggregate checksumming every row_hash of a chunk, ordered by column
         """
-        ret = {
-            'user': args['user'],
-            'host': args['host'],
-            'port': args['port'],
-            'database': args['db']
-        }
+        raise NotImplementedError
 
-        if 'passwd' in args:
-            ret['password'] = args['passwd']
+    def _get_foreign_key_sql(self):
+        """
+        return sql selecting every column of every foreign key in the database as
+            constraint, table, column, referenced table, referenced column
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def _get_key_range_sql(cls, column, low, high):
+        """
+        return a where clause (and params) for the keyset chunk low < column <= high,
+        a low of None means the chunk starts at the beginning of the table
+        """
+        if low is None:
+            return '"{0}" <= %s'.format(column), (high, )
+        return '"{0}" > %s and "{0}" <= %s'.format(column), (low, high)
 
-        return ret
+    def _get_row_hash_sql(self, columns):
+        """
+        return an sql expression giving the md5 hex digest of the given columns of a row
+        """
+        raise NotImplementedError
 
     #
     # PUBLIC methods
@@ -59,42 +96,47 @@ class PDBC(object):
         """
         parse parameter with relevant adapter based on type
         """
-        if self._is_postgres():
-            if isinstance(param, list) or isinstance(param, dict):
-                return psycopg2.extras.Json(param)
-            else:
-                return param
-        else:
-            return param
+        return param
 
     def affected_rows(self, cursor):
         """
-        mysql doesn't use cursors in RL, so the connection holds that info
+        return the number of rows affected by the last statement run on cursor
         """
-        if self._is_postgres():
-            return cursor.rowcount
-        else:
-            return self.con.affected_rows()
+        return cursor.rowcount
 
     def autocommit(self, autocommit):
         """
         set autocommit on or off depending on passed in autocommit boolean
         """
-        if self._is_postgres():
-            self.con.set_session(autocommit=autocommit)
-        else:
-            self.con.autocommit(autocommit)
+        raise NotImplementedError
 
     def connect(self, args):
         """
         connect to the database
-            args: host, user, port, db, password
+            args: host, user, port, db, password, optionally lock_timeout and statement_timeout
+            (seconds) to apply to every transaction on the connection
         """
-        if self._is_postgres():
-            args = PDBC._map_connect_args(args)
-
         self.con = self.driver.connect(**args)
 
+    def bulk_insert(self, table, columns, rows):
+        """
+        insert many rows at once, returning the number of rows inserted
+            table - table to insert into
+            columns - list of columns to insert
+            rows - list of tuples of values, in the order of columns
+        """
+        raise NotImplementedError
+
+    def bulk_update(self, table, column, columns, rows):
+        """
+        update many rows at once, returning the number of rows updated
+            table - table to update
+            column - key column to match rows on
+            columns - list of columns to update
+            rows - list of tuples of (key, value, value..), values in the order of columns
+        """
+        raise NotImplementedError
+
     def close(self):
         """
         straight passthrough
@@ -109,89 +151,167 @@ class PDBC(object):
 
     def cursor(self):
         """
-        straight passthrough
+        straight passthrough, unless we're being traced
         """
+        if self.tracer is not None:
+            return self.tracer.wrap(self.con.cursor(), self.host_alias)
         return self.con.cursor()
 
     def dump(self, args):
         """
-            get the appropriate command line args for dumping to disk
-            args is a dict containing connection vars, host, user, pass etc
-        """
-        if self._is_postgres():
-            # pg_dump can't doesn't have a where filter
-            # psql doesn't do (global) temporary tables
-            # this seems like the best solution
-            cur = self.cursor()
-            select_sql = 'select * from "{0}" where "{1}" = %s'.format(
-                args['table'], args['column']
-            )
-            select_sql = cur.mogrify(select_sql, (args['filter'], )).decode(encoding='UTF-8')
-            copy_sql = 'copy ({0}) to STDOUT'.format(select_sql)
-            outfile = open(args['dump_file'], 'wb', 0)
-            cur.copy_expert(copy_sql, outfile)
-            cur.close()
-            outfile.close()
-        else:
-            dump_args = [
-                'mysqldump', '--host', args['host'], '--user', args['user'],
-                '--port', args['port'], '--no-create-info', '--databases', args['database'],
-                '--tables', args['table'], '--where',
-                '{0} = \'{1}\''.format(args['column'], args['filter'])
-            ]
-            if 'password' in args:
-                dump_args.append('-p' + args['password'])
-
-            with open(args['dump_file'], 'wb', 0) as outfile, \
-                open(args['error_log'], 'wb', 0) as errfile:
-                dump_process = Popen(dump_args, stdout=outfile, stderr=errfile)
-            ret = dump_process.wait()
-
-            return ret
-
-    def dict_query(self, sql):
-        """
-        function to return a dict array [{column: value}] from an sql query
-        """
-        if self._is_postgres():
-            cur = self.con.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute(sql)
-            if cur.rowcount == 0:
-                return []
-            if cur.rowcount > 1:
-                return ['foo', 'bar']
-            row = cur.fetchone()
-            cur.close()
-            return [row]
-        else:
-            self.con.query(sql)
-            res = self.con.store_result()
-            if res.num_rows() == 0:
-                return []
-            if res.num_rows() > 1:
-                return ['foo', 'bar']
-            row = res.fetch_row(how=1)
-
-            return [dict(row[0])]
+            dump the rows where args['column'] = args['filter'] in args['table'] to args['dump_file'].
+            We dump over this connection, so the dump sees the same snapshot as anything we've
+            already selected. A manifest of the dump is written alongside it, see validate_dump
+            args['filter'] may be a list of keys, in which case every matching row is dumped.
+            Returns the DumpWriter the dump was written through
+        """
+        batch = isinstance(args['filter'], list)
+        param = tuple(args['filter']) if batch else args['filter']
+        select_sql = 'select * from "{0}" where "{1}" {2} %s'.format(
+            args['table'], args['column'], 'in' if batch else '='
+        )
+        cur = self.cursor()
+        outfile = self._dump_rows(cur, select_sql, param, args)
+        cur.close()
+        outfile.close()
+        with open(args['dump_file'] + '.manifest', 'w') as handle:
+            json.dump({
+                'table': args['table'],
+                'column': args['column'],
+                'rows': outfile.rows,
+                'bytes': outfile.size,
+                'sha256': outfile.sha256.hexdigest(),
+                'header': outfile.header.decode('UTF-8'),
+                'keys': outfile.keys,
+                'created': datetime.datetime.now().isoformat()
+            }, handle)
+        return outfile
+
+    def dict_query(self, sql, params=None):
+        """
+        function to return a dict array [{column: value}] from an sql query. With params,
+        sql is run as a prepared statement, see execute_prepared
+        """
+        raise NotImplementedError
+
+    def execute_prepared(self, cur, sql, params):
+        """
+        execute sql with params on cur as a server side prepared statement. Statements are prepared
+        the second time they're run on this connection and reused after, so sql of the same shape
+        (e.g. the same table and columns) is only parsed and planned once or twice. Backends which
+        can't prepare statements execute sql as normal
+        """
+        return cur.execute(sql, params)
+
+    def explain(self, sql, params=None):
+        """
+        return how the database would run a select, without running it: {rows, access, full_scan},
+        rows being roughly how many rows it would read, access how it would read them, e.g.
+        "Index Scan on my_table using my_table_pkey", and full_scan whether any table is read
+        in full
+        """
+        raise NotImplementedError
+
+    def get_catalog(self, table=None):
+        """
+        return the columns of every table in the database, in one query:
+            {table: [columns, see get_columns]}
+
+        Keyword arguments:
+        table -- only return the columns of this table
+        """
+        cur = self.cursor()
+        cur.execute(self._get_catalog_sql(table), (table, ) if table is not None else ())
+        res = cur.fetchall()
+        cur.close()
+        catalog = {}
+        for row in res:
+            catalog.setdefault(row[0], []).append({
+                'name': row[1],
+                'type': row[2],
+                'column_type': row[3],
+                'nullable': row[4] == 'YES',
+                'default': row[5],
+                'primary_key': bool(row[6]),
+                'auto_increment': bool(row[7])
+            })
+        return catalog
+
+    @classmethod
+    def get_backend(cls, driver):
+        """
+        return the PDBC subclass implementing driver, importing it (and the driver) if need be
+        """
+        if driver not in PDBC.BACKENDS:
+            raise ValueError('unknown driver: {0}, expected one of {1}'.format(
+                driver, ', '.join(sorted(PDBC.BACKENDS))
+            ))
+        started = time.perf_counter()
+        module = importlib.import_module(PDBC.BACKENDS[driver])
+        logging.debug('loaded %s backend in %.3fs', driver, time.perf_counter() - started)
+        return getattr(module, PDBC.BACKENDS[driver])
+
+    def get_chunk_bound(self, table, column, low, size):
+        """
+        return the upper key of the next keyset paginated chunk of a table, or None at the end
+
+        Keyword arguments:
+        table -- the table we're walking
+        column -- the (indexed, unique) key column we're walking the table on
+        low -- the upper key of the previous chunk, None for the first chunk
+        size -- the maximum number of rows in a chunk
+        """
+        where_sql, params = ('', ()) if low is None else ('where "{0}" > %s'.format(column), (low, ))
+        sql = 'select max("{1}") from (select "{1}" from "{0}" {2} order by "{1}" limit %s) chunk'.format(
+            table, column, where_sql
+        )
+        cur = self.cursor()
+        cur.execute(sql, params + (size, ))
+        res = cur.fetchone()
+        cur.close()
+        return res[0]
+
+    def get_chunk_checksum(self, table, column, columns, low, high):
+        """
+        return a (row count, checksum) tuple computed server side for a chunk of the table
+
+        Keyword arguments:
+        table -- the table we're walking
+        column -- the key column we're walking the table on
+        columns -- the columns to include in the checksum
+        low, high -- bounds of the chunk, see _get_key_range_sql
+        """
+        where_sql, params = PDBC._get_key_range_sql(column, low, high)
+        checksum_sql = self._get_checksum_sql(self._get_row_hash_sql(columns), column)
+        sql = 'select count(*), {0} from "{1}" where {2}'.format(checksum_sql, table, where_sql)
+        cur = self.cursor()
+        cur.execute(sql, params)
+        res = cur.fetchone()
+        cur.close()
+        return tuple(res)
+
+    def get_columns(self, table):
+        """
+        return a list of dicts describing the columns of a table, in table order:
+            [{name, type, column_type, nullable, default, primary_key, auto_increment}]
+        type is the information_schema data_type, column_type the full type, e.g. varchar(32)
+        """
+        return self.get_catalog(table).get(table, [])
 
     def get_column_sql(self, table, column):
         """
         return sql to add or drop a given column from the table passed in on the command line
 
         Keyword arguments:
-        con -- MySQLdb.connection object of the database we're using (source or target)
-        column -- the column to return sql for
-        """
-        drop_sql = 'alter table `{0}` drop column `{1}`;'.format(table, column)
-        # using con.query instead of con.cursor.execute gives us a nicer return format
-        self.query('show fields from {0} where field = \'{1}\''.format(table, column))
-        res = self.con.store_result()
-        # using how=1 and parsing into a dict lets us manipulate with the returned data easily
-        column_info = dict(res.fetch_row(how=1)[0])
-        not_null = '' if column_info['Null'] == 'YES' else ' not null'
-        default = '' if column_info['Default'] is None else ' default ' + column_info['Default']
-        add_sql = 'alter table `{0}` add column `{1}` {2}{3}{4};'.format(
-            table, column, column_info['Type'], default, not_null
+        table -- the table the column belongs to
+        column -- dict describing the column, as returned by get_columns
+        """
+        quote = self.quote
+        drop_sql = 'alter table {0}{1}{0} drop column {0}{2}{0};'.format(quote, table, column['name'])
+        not_null = '' if column['nullable'] else ' not null'
+        default = '' if column['default'] is None else ' default ' + column['default']
+        add_sql = 'alter table {0}{1}{0} add column {0}{2}{0} {3}{4}{5};'.format(
+            quote, table, column['name'], column['column_type'], default, not_null
         )
         return {
             'add_sql': add_sql,
@@ -202,38 +322,13 @@ class PDBC(object):
         """
         prompt the user how to get a connection to the database, used for manual rollback
         """
-        if self._is_postgres():
-            return 'psql --host {0} --port {1} --user {2} --pass {3}'.format(
-                args['host'], args['port'], args['user'], args['database']
-            )
-        else:
-            return 'mysql -h {0} -P {1} -u {2} -p {3}'.format(
-                args['host'], args['port'], args['user'], args['database']
-            )
+        raise NotImplementedError
 
     def get_encoding(self, database, table):
         """
         return character set and collation for the table we're working on
         """
-        if self._is_postgres():
-            # seems postgres does database level encoding
-            return self.con.get_parameter_status('server_encoding')
-        sql = """select
-                ccsa.character_set_name,
-                ccsa.collation_name
-            from
-                information_schema.tables t,
-                information_schema.collation_character_set_applicability ccsa
-            where
-                ccsa.collation_name = t.table_collation and
-                t.table_schema = '{0}' and
-                t.table_name = '{1}';
-            """
-        sql = sql.format(database, table)
-        self.query(sql)
-        res = self.con.store_result()
-        row = dict(res.fetch_row(how=1)[0])
-        return '{0}:{1}'.format(row['character_set_name'], row['collation_name'])
+        raise NotImplementedError
 
     def get_exception_class(self, exception_class):
         """
@@ -244,88 +339,136 @@ class PDBC(object):
             'ProgrammingError': self.driver.ProgrammingError,
         }.get(exception_class)
 
-    def get_last_executed(self, cursor):
+    def get_fingerprint(self, database, table):
         """
-        returns statement last executed by given cursor
+        return a cheap fingerprint of the table's definition, which changes when its ddl does,
+        or None if the table doesn't exist
         """
-        if self._is_postgres():
-            return cursor.query
-        else:
-            # no public access in mysql
-            return cursor._last_executed # pylint: disable=locally-disabled,protected-access
+        raise NotImplementedError
+
+    def get_hash_sql(self, column, data_type): # pylint: disable=locally-disabled,unused-argument
+        """
+        return an sql expression giving the md5 hex digest of a (large) column
+
+        Keyword arguments:
+        column -- the column to hash
+        data_type -- information_schema data type of the column
+        """
+        return 'md5("{0}")'.format(column)
 
     def get_load_sql(self, dump_file, table):
         """
         sql that can be run by the user to load the dump_file manually
         """
-        if self._is_postgres():
-            return 'copy {0} from \'{1}\';'.format(table, dump_file)
-        else:
-            return 'source ' + dump_file
-
-    def get_mandatory_columns(self, table):
-        """
-        return a list of columns that are not nullable and have no defaults
-        """
-        if self._is_postgres():
-            sql = """
-            select
-                column_name,
-                is_nullable,
-                column_default
-            from
-                information_schema.columns
-            where
-                is_nullable = 'NO' and
-                column_default IS NULL and
-                table_name = '{0}'
-            """
-            sql = sql.format(table)
-            cur = self.con.cursor()
-            cur.execute(sql)
-            res = cur.fetchall()
-            cur.close()
-            return [row[0] for row in res]
-        else:
-            raise "not implemented"
+        raise NotImplementedError
+
+    def get_row_checksums(self, table, column, columns, low, high):
+        """
+        return a dict of {key: md5 of the row} for every row in a chunk of the table
+
+        Keyword arguments:
+        see get_chunk_checksum
+        """
+        where_sql, params = PDBC._get_key_range_sql(column, low, high)
+        sql = 'select "{0}", {1} from "{2}" where {3}'.format(
+            column, self._get_row_hash_sql(columns), table, where_sql
+        )
+        cur = self.cursor()
+        cur.execute(sql, params)
+        res = cur.fetchall()
+        cur.close()
+        return dict((row[0], row[1]) for row in res)
+
+    def get_foreign_keys(self):
+        """
+        return every single column foreign key in the database, in one query:
+            [{table, column, ref_table, ref_column}]
+        foreign keys over several columns are left out
+        """
+        cur = self.cursor()
+        cur.execute(self._get_foreign_key_sql())
+        res = cur.fetchall()
+        cur.close()
+        constraints = {}
+        for row in res:
+            constraints.setdefault((row[1], row[0]), []).append({
+                'table': row[1],
+                'column': row[2],
+                'ref_table': row[3],
+                'ref_column': row[4]
+            })
+        return [columns[0] for key, columns in sorted(constraints.items()) if len(columns) == 1]
+
+    def get_table_metadata(self, database, table):
+        """
+        return everything we need to know about the definition of a table:
+            {columns (see get_columns), encoding (see get_encoding)}
+        """
+        return {
+            'columns': self.get_columns(table),
+            'encoding': self.get_encoding(database, table)
+        }
 
     def get_server_info(self):
         """
-        straight passthrough
+        return the version of the server we're connected to
+        """
+        raise NotImplementedError
+
+    def is_large_type(self, data_type):
+        """
+        return true if values of the given information_schema data type are potentially large
+        enough that we'd rather compare hashes than transfer them
+        """
+        return data_type in self.large_types
+
+    def is_retryable(self, exception):
+        """
+        return true if exception is a deadlock or serialization failure, after which the
+        transaction has been rolled back and can be run again
         """
-        if self._is_postgres():
-            return self.con.server_version
-        else:
-            return self.con.get_server_info()
+        raise NotImplementedError
+
+    def ping(self):
+        """
+        return true if the connection is still usable
+        """
+        raise NotImplementedError
+
+    def mogrify(self, sql, params):
+        """
+        return the statement (as bytes) that executing sql with params would run, without running it
+        """
+        raise NotImplementedError
 
     def query(self, sql):
         """
-        straight passthrough
+        straight passthrough, unless we're being traced
         """
-        return self.con.query(sql)
+        if self.tracer is None:
+            return self.con.query(sql)
+        started = time.perf_counter()
+        try:
+            return self.con.query(sql)
+        finally:
+            self.tracer.record(self.host_alias, sql, time.perf_counter() - started, None)
+
+    @classmethod
+    def register(cls, driver, backend):
+        """
+        register (or replace) the backend for a driver, for host aliases configured with it
+
+        Keyword arguments:
+        driver -- the driver, as configured for a host alias
+        backend -- name of the module the backend is in, which has a PDBC subclass of the same name
+        """
+        PDBC.BACKENDS[driver] = backend
 
     def load(self, dump_file, table):
         """
         load a dump file into the given database + table
         """
-        handle = open(dump_file, encoding='latin-1')
-        cur = self.cursor()
-
-        if self._is_postgres():
-            cur.copy_from(handle, table)
-        else:
-            for line in handle:
-                # only run the insert:
-                #   - ignore locks (only one row)
-                #   - ignore encoding (handled herein separately)
-                if line.find('INSERT') == 0:
-                    cur.execute(line)
-
-        ret = self.affected_rows(cur)
-        cur.close()
-        handle.close()
-
-        return ret
+        raise NotImplementedError
 
     def rollback(self):
         """
@@ -333,22 +476,106 @@ class PDBC(object):
         """
         return self.con.rollback()
 
-    def validate_dump(self, dump_file):
+    def stream_query(self, sql, params=None):
+        """
+        generator yielding the rows of an sql query as dicts {column: value} as they arrive,
+        itersize rows at a time, from a server side cursor. Memory stays flat however many rows
+        there are. Nothing else can be run on the connection until every row has been read
+        """
+        raise NotImplementedError
+
+    def trace(self, tracer, host_alias):
+        """
+        record every statement run on this connection with a SqlTracer, or stop if tracer is None
+
+        Keyword arguments:
+        tracer -- the SqlTracer
+        host_alias -- the configured alias of the host we're connected to, statements are recorded against it
+        """
+        self.tracer = tracer
+        self.host_alias = host_alias
+
+    def validate_dump(self, dump_file, rows=1, written=None):
         """
-        validate a file dumped by dump, returning true or false
+        validate a file dumped by dump against its manifest, returning true or false
         dump_file - string filename
+        rows - number of rows the dump is expected to contain
+        written - the DumpWriter dump just wrote the file through, if any. Its rows, bytes and
+                  hash are checked instead of reading the whole dump back
+        """
+        try:
+            with open(dump_file + '.manifest') as handle:
+                manifest = json.load(handle)
+        except (IOError, ValueError):
+            return False
+        if manifest['rows'] != rows or os.path.getsize(dump_file) != manifest['bytes']:
+            return False
+        if written is not None:
+            return (written.rows, written.size, written.sha256.hexdigest()) == \
+                (manifest['rows'], manifest['bytes'], manifest['sha256'])
+        # reading a backup back, a dump corrupted in place is the same size, only its content gives it away
+        sha256 = hashlib.sha256()
+        with open(dump_file, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest() == manifest['sha256']
+
+class DumpWriter(object):
+    """ binary file wrapper counting the rows and bytes written through it, and hashing them """
+
+    def __init__(self, handle, key_index=None):
+        """
+        Keyword arguments:
+        handle -- binary file handle to write to
+        key_index -- for postgres COPY text, the index of the key in each row. Keys are parsed out
+                     of the rows as they're written. Otherwise, the caller appends to keys
+        """
+        self.handle = handle
+        self.header = b''
+        self.key_index = key_index
+        self.keys = []
+        self.partial = b''
+        self.rows = 0
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    @classmethod
+    def _unescape_copy_value(cls, value):
+        """
+        return a single value in postgres COPY text format as a string (or None)
+        """
+        if value == '\\N':
+            return None
+        escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+        return re.sub(r'\\(.)', lambda match: escapes.get(match.group(1), match.group(1)), value)
+
+    def close(self):
+        """
+        straight passthrough
+        """
+        return self.handle.close()
+
+    def write(self, data):
+        """
+        write data to the file, every dump format has exactly one row per line (after any header)
+        """
+        self.rows += data.count(b'\n')
+        if self.key_index is not None:
+            # rows may span writes
+            lines = (self.partial + data).split(b'\n')
+            self.partial = lines.pop()
+            for line in lines:
+                value = line.split(b'\t')[self.key_index].decode('UTF-8', 'replace')
+                self.keys.append(DumpWriter._unescape_copy_value(value))
+        self.size += len(data)
+        self.sha256.update(data)
+        return self.handle.write(data)
+
+    def write_header(self, data):
+        """
+        write data which isn't a row (e.g. SET NAMES) to the file, before any rows are written
         """
-        handle = open(dump_file, encoding='latin-1')
-        ret = False
-        if self._is_postgres():
-            num_lines = sum(1 for line in handle)
-            if num_lines == 1:
-                ret = True
-        else:
-            # do some basic sanity checking - we should only have one INSERT line
-            num_lines = sum(1 for line in handle if line.find('INSERT') == 0)
-            if num_lines == 1:
-                ret = True
-
-        handle.close()
-        return ret
+        self.header += data
+        self.size += len(data)
+        self.sha256.update(data)
+        return self.handle.write(data)
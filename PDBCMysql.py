@@ -0,0 +1,401 @@
+""" PDBC backend for mysql, via MySQLdb """
+
+# internal imports
+import json
+import logging
+import os
+import tempfile
+import time
+
+# external imports
+import MySQLdb
+import MySQLdb.cursors
+from PDBC import DumpWriter, PDBC
+
+class PDBCMysql(PDBC):
+    """ PDBCMysql constructor, see PDBC """
+
+    driver = MySQLdb
+    large_types = ['blob', 'json', 'longblob', 'longtext', 'mediumblob', 'mediumtext', 'text']
+    quote = '`'
+
+    #
+    # PRIVATE methods
+    #
+
+    def _dump_rows(self, cur, select_sql, param, args):
+        """
+        dump the rows select_sql selects to args['dump_file'] as INSERT statements
+        """
+        outfile = DumpWriter(open(args['dump_file'], 'wb', 0))
+        # write the same INSERT per row mysqldump --skip-extended-insert would,
+        # without spawning it and authenticating all over again. Rows are streamed
+        # rather than buffered, so the backup never has to fit in memory
+        insert_sql = 'INSERT INTO `{0}` VALUES '.format(args['table']).encode('UTF-8')
+        # as mysqldump does, so `source` (see get_load_sql) reads the rows in the character set they're in
+        outfile.write_header('SET NAMES {0};\n'.format(self.con.character_set_name()).encode('UTF-8'))
+        for row in self.stream_query(select_sql, (param, )):
+            outfile.keys.append(str(row[args['column']]))
+            outfile.write(insert_sql + self.con.literal(tuple(row.values())) + b';\n')
+        return outfile
+
+    def _get_catalog_sql(self, table):
+        """
+        return sql selecting the columns of every table (or just table) in the current database
+        """
+        return """
+            select
+                table_name,
+                column_name,
+                data_type,
+                column_type,
+                is_nullable,
+                column_default,
+                column_key = 'PRI',
+                extra like '%%auto_increment%%'
+            from
+                information_schema.columns
+            where
+                table_schema = database() {0}
+            order by
+                table_name,
+                ordinal_position
+            """.format('and table_name = %s' if table is not None else '')
+
+    def _get_checksum_sql(self, row_hash, column):
+        """
+        return an sql aggregate checksumming every row_hash of a chunk
+        """
+        # order independent xor of both halves of each row's md5, a la pt-table-checksum
+        return ', '.join(
+            'coalesce(bit_xor(cast(conv(substring({0}, {1}, 16), 16, 10) as unsigned)), 0)'.format(
+                row_hash, start
+            ) for start in (1, 17)
+        )
+
+    def _get_foreign_key_sql(self):
+        """
+        return sql selecting every column of every foreign key in the current database
+        """
+        return """
+            select
+                constraint_name,
+                table_name,
+                column_name,
+                referenced_table_name,
+                referenced_column_name
+            from
+                information_schema.key_column_usage
+            where
+                table_schema = database() and
+                referenced_table_name is not null
+            """
+
+    def _get_infile_value(self, value):
+        """
+        return a single value (as bytes) in the default mysql LOAD DATA format
+        """
+        if value is None:
+            return b'\\N'
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        if not isinstance(value, (bytes, bytearray)):
+            value = str(value).encode(self.con.encoding)
+        return bytes(value).replace(b'\\', b'\\\\').replace(b'\0', b'\\0') \
+            .replace(b'\n', b'\\n').replace(b'\r', b'\\r').replace(b'\t', b'\\t')
+
+    def _get_row_hash_sql(self, columns):
+        """
+        return an sql expression giving the md5 hex digest of the given columns of a row
+        """
+        # concat_ws skips nulls, so add null markers to tell (null, 'a') from ('a', null)
+        return 'md5(concat_ws(\'#\', {0}, {1}))'.format(
+            ', '.join('"{0}"'.format(c) for c in columns),
+            ', '.join('isnull("{0}")'.format(c) for c in columns)
+        )
+
+    def _insert_values(self, cur, insert_sql, values):
+        """
+        run a single insert of every row in values, returning the number of rows inserted
+
+        Keyword arguments:
+        cur -- cursor to run it on
+        insert_sql -- everything before VALUES, e.g. INSERT INTO `my_table`
+        values -- the (..) of each row, as bytes
+        """
+        if not values:
+            return 0
+        cur.execute(insert_sql + b' VALUES ' + b','.join(values))
+        return self.affected_rows(cur)
+
+    def _load_staging(self, cur, staging, columns, rows):
+        """
+        load rows into a staging table, with LOAD DATA LOCAL INFILE if the server (and
+        connection, see local_infile in README) allow it, otherwise with multi-row inserts
+        """
+        column_sql = ', '.join('"{0}"'.format(c) for c in columns)
+        handle = tempfile.NamedTemporaryFile(prefix='clone_row_', suffix='.tsv', delete=False)
+        try:
+            for row in rows:
+                handle.write(b'\t'.join(self._get_infile_value(value) for value in row) + b'\n')
+            handle.close()
+            cur.execute(
+                'load data local infile %s into table {0} character set {1} ({2})'.format(
+                    staging, self.con.character_set_name(), column_sql
+                ),
+                (handle.name, )
+            )
+            return
+        except (self.driver.OperationalError, self.driver.ProgrammingError) as ex:
+            logging.warning('LOAD DATA LOCAL INFILE unavailable (%s), falling back to inserts', ex)
+        finally:
+            os.remove(handle.name)
+        # executemany turns this into as few multi-row inserts as will fit in a packet
+        cur.executemany(
+            'insert into {0} ({1}) values ({2})'.format(staging, column_sql, ', '.join(['%s'] * len(columns))),
+            rows
+        )
+
+    #
+    # PUBLIC methods
+    #
+
+    def affected_rows(self, cursor):
+        """
+        mysql doesn't use cursors in RL, so the connection holds that info
+        """
+        return self.con.affected_rows()
+
+    def autocommit(self, autocommit):
+        """
+        set autocommit on or off depending on passed in autocommit boolean
+        """
+        self.con.autocommit(autocommit)
+
+    def connect(self, args):
+        """
+        connect to the database, see PDBC
+        """
+        args = dict(args)
+        settings = []
+        lock_timeout = args.pop('lock_timeout', None)
+        if lock_timeout:
+            # row locks and metadata locks, in whole seconds
+            settings.append('innodb_lock_wait_timeout = {0}'.format(max(int(lock_timeout), 1)))
+            settings.append('lock_wait_timeout = {0}'.format(max(int(lock_timeout), 1)))
+        statement_timeout = args.pop('statement_timeout', None)
+        if statement_timeout:
+            # only applies to selects
+            settings.append('max_execution_time = {0}'.format(int(statement_timeout * 1000)))
+        if settings:
+            # run again on every reconnect
+            args['init_command'] = 'set session ' + ', '.join(settings)
+        self.con = self.driver.connect(**args)
+
+    def bulk_insert(self, table, columns, rows):
+        """
+        insert many rows at once, returning the number of rows inserted
+        """
+        cur = self.cursor()
+        # mysql executemany turns this into multi-row inserts
+        insert_sql = 'insert into "{0}" ({1}) values ({2})'.format(
+            table,
+            ', '.join('"{0}"'.format(column) for column in columns),
+            ', '.join(['%s'] * len(columns))
+        )
+        cur.executemany(insert_sql, rows)
+        ret = self.affected_rows(cur)
+        cur.close()
+        return ret
+
+    def bulk_update(self, table, column, columns, rows):
+        """
+        update many rows at once, returning the number of rows updated. The rows are loaded
+        into a staging table, then applied in a single update
+        """
+        cur = self.cursor()
+        column_sql = ', '.join('"{0}"'.format(c) for c in columns)
+        # temporary tables aren't dropped on rollback, so one may be left by an earlier failed update
+        # on this (pooled or retried) connection
+        cur.execute('drop temporary table if exists clone_row_staging')
+        cur.execute(
+            'create temporary table clone_row_staging (index ("{1}")) select "{1}", {2} from "{0}" limit 0'.format(
+                table, column, column_sql
+            )
+        )
+        try:
+            self._load_staging(cur, 'clone_row_staging', [column] + columns, rows)
+            cur.execute('update "{0}" join clone_row_staging s on "{0}"."{1}" = s."{1}" set {2}'.format(
+                table, column, ', '.join('"{0}"."{1}" = s."{1}"'.format(table, c) for c in columns)
+            ))
+            ret = self.affected_rows(cur)
+        finally:
+            cur.execute('drop temporary table if exists clone_row_staging')
+            cur.close()
+        return ret
+
+    def dict_query(self, sql, params=None):
+        """
+        function to return a dict array [{column: value}] from an sql query, params are bound
+        client side (MySQLdb has no server side prepared statements)
+        """
+        if params is not None:
+            sql = self.mogrify(sql, params)
+        started = time.perf_counter()
+        self.con.query(sql)
+        res = self.con.store_result()
+        # maxrows=0 fetches every row in the result set
+        rows = [dict(row) for row in res.fetch_row(maxrows=0, how=1)]
+        if self.tracer is not None:
+            statement = self.tracer.record(self.host_alias, sql, time.perf_counter() - started, len(rows))
+            self.tracer.fetched(statement, 0, rows)
+        return rows
+
+    def explain(self, sql, params=None):
+        """
+        return how mysql would run a select, see PDBC
+        """
+        # ALL reads the whole table, index the whole of an index
+        scans = [row for row in self.dict_query('explain ' + sql, params) if row['table'] is not None]
+        return {
+            'rows': sum(int(row['rows'] or 0) for row in scans),
+            'access': ', '.join(
+                '{0} on {1}'.format(row['type'], row['table']) +
+                (' using {0}'.format(row['key']) if row['key'] else '')
+                for row in scans
+            ),
+            'full_scan': bool([row for row in scans if row['type'] in ['ALL', 'index']])
+        }
+
+    def is_retryable(self, exception):
+        """
+        return true if exception is a deadlock, see PDBC. Lock wait timeouts aren't retried,
+        they only roll back the statement and are there to fail fast
+        """
+        return isinstance(exception, self.driver.OperationalError) and exception.args[0] == 1213
+
+    def stream_query(self, sql, params=None):
+        """
+        generator yielding the rows of an sql query from an unbuffered (use_result) cursor, see PDBC
+        """
+        cur = self.con.cursor(MySQLdb.cursors.SSDictCursor)
+        if self.tracer is not None:
+            cur = self.tracer.wrap(cur, self.host_alias)
+        try:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(self.itersize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            # reads (and throws away) any rows left, so the connection can be used again
+            cur.close()
+
+    def get_connection_string(self, args):
+        """
+        prompt the user how to get a connection to the database, used for manual rollback
+        """
+        return 'mysql -h {0} -P {1} -u {2} -p {3}'.format(
+            args['host'], args['port'], args['user'], args['database']
+        )
+
+    def get_encoding(self, database, table):
+        """
+        return character set and collation for the table we're working on
+        """
+        sql = """select
+                ccsa.character_set_name,
+                ccsa.collation_name
+            from
+                information_schema.tables t,
+                information_schema.collation_character_set_applicability ccsa
+            where
+                ccsa.collation_name = t.table_collation and
+                t.table_schema = '{0}' and
+                t.table_name = '{1}';
+            """
+        sql = sql.format(database, table)
+        self.query(sql)
+        res = self.con.store_result()
+        row = dict(res.fetch_row(how=1)[0])
+        return '{0}:{1}'.format(row['character_set_name'], row['collation_name'])
+
+    def get_fingerprint(self, database, table):
+        """
+        return a cheap fingerprint of the table's definition, which changes when its ddl does,
+        or None if the table doesn't exist
+        """
+        cur = self.cursor()
+        # ddl rebuilding the table resets its create_time
+        cur.execute(
+            'select create_time from information_schema.tables ' +
+            'where table_schema = %s and table_name = %s',
+            (database, table)
+        )
+        res = cur.fetchone()
+        cur.close()
+        if res is None:
+            return None
+        return ':'.join(str(value) for value in res)
+
+    def get_load_sql(self, dump_file, table):
+        """
+        sql that can be run by the user to load the dump_file manually
+        """
+        return 'source ' + dump_file
+
+    def get_server_info(self):
+        """
+        return the version of the server we're connected to
+        """
+        return self.con.get_server_info()
+
+    def ping(self):
+        """
+        return true if the connection is still usable
+        """
+        try:
+            self.con.ping()
+        except (self.driver.OperationalError, self.driver.InterfaceError):
+            return False
+        return True
+
+    def mogrify(self, sql, params):
+        """
+        return the statement (as bytes) that executing sql with params would run, without running it
+        """
+        return sql.encode(self.con.encoding) % tuple(self.con.literal(param) for param in params)
+
+    def load(self, dump_file, table):
+        """
+        load a dump file (INSERT statements) into the given database + table. Consecutive inserts
+        are run as multi-row inserts of up to half max_allowed_packet, rather than one at a time
+        """
+        cur = self.cursor()
+        cur.execute('select @@max_allowed_packet')
+        limit = min(int(cur.fetchone()[0]), 16 * 1024 * 1024) // 2
+        ret = 0
+        insert_sql = None
+        values = []
+        size = 0
+        # the dump is already in the connection's character set, so it's run as bytes
+        with open(dump_file, 'rb') as handle:
+            for line in handle:
+                # only run the inserts:
+                #   - ignore locks (we're already in a transaction)
+                #   - ignore encoding (handled herein separately)
+                if not line.startswith(b'INSERT'):
+                    continue
+                head, _, tail = line.partition(b' VALUES ')
+                if head != insert_sql or size + len(tail) > limit:
+                    ret += self._insert_values(cur, insert_sql, values)
+                    insert_sql, values, size = head, [], 0
+                values.append(tail.rstrip().rstrip(b';'))
+                size += len(tail)
+        ret += self._insert_values(cur, insert_sql, values)
+        cur.close()
+        return ret
@@ -0,0 +1,447 @@
+""" PDBC backend for postgres, via psycopg2 """
+
+# internal imports
+import io
+import json
+import logging
+
+# external imports
+import psycopg2        # pylint: disable=locally-disabled,import-error
+import psycopg2.extras # pylint: disable=locally-disabled,import-error
+from PDBC import DumpWriter, PDBC
+
+class PDBCPostgres(PDBC):
+    """ PDBCPostgres constructor, see PDBC """
+
+    driver = psycopg2
+    large_types = ['bytea', 'json', 'jsonb', 'text']
+
+    def __init__(self, driver=None):
+        super(PDBCPostgres, self).__init__(driver)
+        # named cursors opened by stream_query, each needs a name of its own
+        self.streams = 0
+
+    #
+    # PRIVATE methods
+    #
+
+    def _dump_rows(self, cur, select_sql, param, args):
+        """
+        dump the rows select_sql selects to args['dump_file'] in COPY text format
+        """
+        # we need to know where the key is in each row for the manifest
+        cur.execute('select * from "{0}" limit 0'.format(args['table']))
+        key_index = [d[0] for d in cur.description].index(args['column'])
+        outfile = DumpWriter(open(args['dump_file'], 'wb', 0), key_index)
+        # pg_dump can't doesn't have a where filter
+        # psql doesn't do (global) temporary tables
+        # this seems like the best solution
+        select_sql = cur.mogrify(select_sql, (param, )).decode(encoding='UTF-8')
+        copy_sql = 'copy ({0}) to STDOUT'.format(select_sql)
+        cur.copy_expert(copy_sql, outfile)
+        return outfile
+
+    def _get_catalog_sql(self, table):
+        """
+        return sql selecting the columns of every table (or just table) in the current schema
+        """
+        return """
+            select
+                c.table_name,
+                c.column_name,
+                c.data_type,
+                format_type(a.atttypid, a.atttypmod),
+                c.is_nullable,
+                c.column_default,
+                kcu.column_name is not null,
+                c.is_identity = 'YES'
+            from
+                information_schema.columns c
+                -- information_schema has no full type (e.g. character varying(32)), pg_attribute does
+                join pg_namespace n on
+                    n.nspname = c.table_schema
+                join pg_class pc on
+                    pc.relnamespace = n.oid and
+                    pc.relname = c.table_name
+                join pg_attribute a on
+                    a.attrelid = pc.oid and
+                    a.attname = c.column_name
+                left join (
+                    information_schema.table_constraints tc
+                    join information_schema.key_column_usage kcu on
+                        kcu.constraint_schema = tc.constraint_schema and
+                        kcu.constraint_name = tc.constraint_name
+                ) on
+                    tc.table_schema = c.table_schema and
+                    tc.table_name = c.table_name and
+                    tc.constraint_type = 'PRIMARY KEY' and
+                    kcu.column_name = c.column_name
+            where
+                c.table_schema = current_schema() {0}
+            order by
+                c.table_name,
+                c.ordinal_position
+            """.format('and c.table_name = %s' if table is not None else '')
+
+    def _get_checksum_sql(self, row_hash, column):
+        """
+        return an sql aggregate checksumming every row_hash of a chunk, ordered by column
+        """
+        return 'md5(string_agg({0}, \'\' order by "{1}"))'.format(row_hash, column)
+
+    @classmethod
+    def _get_copy_buffer(cls, rows):
+        """
+        return a buffer of rows (a list of tuples) in postgres COPY text format
+        """
+        buf = io.BytesIO()
+        for row in rows:
+            line = '\t'.join(PDBCPostgres._get_copy_value(value) for value in row) + '\n'
+            buf.write(line.encode('UTF-8'))
+        buf.seek(0)
+        return buf
+
+    @classmethod
+    def _get_copy_value(cls, value):
+        """
+        return a single value in postgres COPY text format
+        """
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            # bytea hex format, with the backslash escaped for COPY
+            return '\\\\x' + bytes(value).hex()
+        if isinstance(value, (dict, list)):
+            # as adapt_param, lists and dicts are json
+            value = json.dumps(value)
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+            .replace('\r', '\\r').replace('\t', '\\t')
+
+    def _get_foreign_key_sql(self):
+        """
+        return sql selecting every column of every foreign key in the current schema
+        """
+        return """
+            select
+                tc.constraint_name,
+                tc.table_name,
+                kcu.column_name,
+                ccu.table_name,
+                ccu.column_name
+            from
+                information_schema.table_constraints tc
+                join information_schema.key_column_usage kcu on
+                    kcu.constraint_schema = tc.constraint_schema and
+                    kcu.constraint_name = tc.constraint_name
+                join information_schema.constraint_column_usage ccu on
+                    ccu.constraint_schema = tc.constraint_schema and
+                    ccu.constraint_name = tc.constraint_name
+            where
+                tc.constraint_type = 'FOREIGN KEY' and
+                tc.table_schema = current_schema()
+            """
+
+    @classmethod
+    def _get_numbered_sql(cls, sql):
+        """
+        return sql with %s params numbered, as PREPARE wants them, e.g. "a" = %s and "b" = %s
+        becomes "a" = $1 and "b" = $2
+        """
+        parts = sql.split('%s')
+        numbered = parts[0] + ''.join('${0}{1}'.format(i, part) for i, part in enumerate(parts[1:], 1))
+        return numbered.replace('%%', '%')
+
+    def _get_row_hash_sql(self, columns):
+        """
+        return an sql expression giving the md5 hex digest of the given columns of a row
+        """
+        return 'md5(row({0})::text)'.format(', '.join('"{0}"'.format(c) for c in columns))
+
+    @classmethod
+    def _map_connect_args(cls, args):
+        """
+        map connect args from mysql to psql
+        db -> database
+        passwd -> password
+        lock_timeout, statement_timeout -> options (milliseconds)
+        """
+        ret = {
+            'user': args['user'],
+            'host': args['host'],
+            'port': args['port'],
+            'database': args['db']
+        }
+
+        if 'passwd' in args:
+            ret['password'] = args['passwd']
+
+        # set for the session at connect, so they survive rollbacks
+        options = [
+            '-c {0}={1}'.format(setting, int(args[setting] * 1000))
+            for setting in ['lock_timeout', 'statement_timeout'] if args.get(setting)
+        ]
+        if options:
+            ret['options'] = ' '.join(options)
+
+        return ret
+
+    #
+    # PUBLIC methods
+    #
+
+    def adapt_param(self, param):
+        """
+        parse parameter with relevant adapter based on type
+        """
+        if isinstance(param, list) or isinstance(param, dict):
+            return psycopg2.extras.Json(param)
+        return param
+
+    def autocommit(self, autocommit):
+        """
+        set autocommit on or off depending on passed in autocommit boolean
+        """
+        self.con.set_session(autocommit=autocommit)
+
+    def connect(self, args):
+        """
+        connect to the database
+            args: host, user, port, db, password
+        """
+        self.con = self.driver.connect(**PDBCPostgres._map_connect_args(args))
+
+    def bulk_insert(self, table, columns, rows):
+        """
+        insert many rows at once with COPY, returning the number of rows inserted
+        """
+        cur = self.cursor()
+        copy_sql = 'copy "{0}" ({1}) from stdin'.format(
+            table, ', '.join('"{0}"'.format(column) for column in columns)
+        )
+        cur.copy_expert(copy_sql, PDBCPostgres._get_copy_buffer(rows))
+        ret = cur.rowcount
+        cur.close()
+        return ret
+
+    def bulk_update(self, table, column, columns, rows):
+        """
+        update many rows at once, returning the number of rows updated. The rows are streamed
+        into a staging table, then applied in a single update
+        """
+        cur = self.cursor()
+        column_sql = ', '.join('"{0}"'.format(c) for c in columns)
+        cur.execute(
+            'create temp table clone_row_staging as select "{1}", {2} from "{0}" with no data'.format(
+                table, column, column_sql
+            )
+        )
+        cur.copy_expert(
+            'copy clone_row_staging ("{0}", {1}) from stdin'.format(column, column_sql),
+            PDBCPostgres._get_copy_buffer(rows)
+        )
+        cur.execute('update "{0}" set {2} from clone_row_staging s where "{0}"."{1}" = s."{1}"'.format(
+            table, column, ', '.join('"{0}" = s."{0}"'.format(c) for c in columns)
+        ))
+        ret = cur.rowcount
+        cur.execute('drop table clone_row_staging')
+        cur.close()
+        return ret
+
+    def dict_query(self, sql, params=None):
+        """
+        function to return a dict array [{column: value}] from an sql query. With params,
+        sql is run as a prepared statement, see execute_prepared
+        """
+        cur = self.con.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        if self.tracer is not None:
+            cur = self.tracer.wrap(cur, self.host_alias)
+        if params is not None:
+            self.execute_prepared(cur, sql, params)
+        else:
+            cur.execute(sql)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    def execute_prepared(self, cur, sql, params):
+        """
+        execute sql with params on cur as a prepared statement (PREPARE, then EXECUTE), see PDBC
+        """
+        name = self.prepared.get(sql)
+        if name is None:
+            if sql not in self.prepared:
+                # a statement run once isn't worth the extra round trip to prepare it
+                self.prepared[sql] = None
+                return cur.execute(sql, params)
+            name = 'clone_row_{0}'.format(len([name for name in self.prepared.values() if name]) + 1)
+            cur.execute('prepare {0} as {1}'.format(name, PDBCPostgres._get_numbered_sql(sql)))
+            self.prepared[sql] = name
+        execute_sql = 'execute {0} ({1})'.format(name, ', '.join(['%s'] * len(params)))
+        # a select is prepared for the columns it returns, which may have been altered since (e.g.
+        # by the schema updates we suggest, between jobs on a pooled connection). Postgres refuses to
+        # run it then, so in a transaction it's run from a savepoint (in the same round trip) we can
+        # go back to. Only selects, other statements would each start a subtransaction
+        savepoint = sql.lstrip().lower().startswith('select') and not self.con.autocommit
+        try:
+            return cur.execute(('savepoint clone_row_prepared; ' if savepoint else '') + execute_sql, params)
+        except self.driver.Error as ex:
+            # cached plan must not change result type
+            if ex.pgcode != '0A000':
+                raise
+        logging.info('%s has changed since it was prepared, preparing it again', name)
+        if savepoint:
+            cur.execute('rollback to savepoint clone_row_prepared')
+        cur.execute('deallocate {0}'.format(name))
+        cur.execute('prepare {0} as {1}'.format(name, PDBCPostgres._get_numbered_sql(sql)))
+        return cur.execute(execute_sql, params)
+
+    def explain(self, sql, params=None):
+        """
+        return how postgres would run a select, see PDBC
+        """
+        cur = self.cursor()
+        cur.execute('explain (format json) ' + sql, params)
+        nodes = [cur.fetchone()[0][0]['Plan']]
+        scans = []
+        while nodes:
+            node = nodes.pop()
+            nodes += node.get('Plans', [])
+            if 'Relation Name' in node:
+                scans.append(node)
+        rows = 0
+        for node in scans:
+            if node['Node Type'] == 'Seq Scan':
+                # Plan Rows is what's left after the filter, we want what's read
+                cur.execute(
+                    'select reltuples from pg_class where oid = to_regclass(%s)', (node['Relation Name'], )
+                )
+                res = cur.fetchone()
+                rows += max(int(res[0]) if res is not None else 0, node['Plan Rows'])
+            else:
+                rows += node['Plan Rows']
+        cur.close()
+        return {
+            'rows': rows,
+            'access': ', '.join(
+                '{0} on {1}'.format(node['Node Type'], node['Relation Name']) +
+                (' using {0}'.format(node['Index Name']) if 'Index Name' in node else '')
+                for node in scans
+            ),
+            'full_scan': bool([node for node in scans if node['Node Type'] == 'Seq Scan'])
+        }
+
+    def is_retryable(self, exception):
+        """
+        return true if exception is a deadlock or serialization failure, see PDBC
+        """
+        return isinstance(exception, self.driver.Error) and exception.pgcode in ['40001', '40P01']
+
+    def stream_query(self, sql, params=None):
+        """
+        generator yielding the rows of an sql query from a named (server side) cursor, see PDBC
+        """
+        self.streams += 1
+        # outside a transaction the cursor has to outlive the commit of its declaration
+        cur = self.con.cursor(
+            name='clone_row_stream_{0}'.format(self.streams),
+            cursor_factory=psycopg2.extras.DictCursor,
+            withhold=self.con.autocommit
+        )
+        cur.itersize = self.itersize
+        if self.tracer is not None:
+            cur = self.tracer.wrap(cur, self.host_alias)
+        try:
+            cur.execute(sql, params)
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+
+    def get_connection_string(self, args):
+        """
+        prompt the user how to get a connection to the database, used for manual rollback
+        """
+        return 'psql --host {0} --port {1} --user {2} --pass {3}'.format(
+            args['host'], args['port'], args['user'], args['database']
+        )
+
+    def get_encoding(self, database, table):
+        """
+        return character set and collation for the table we're working on
+        """
+        # seems postgres does database level encoding
+        return self.con.get_parameter_status('server_encoding')
+
+    def get_fingerprint(self, database, table):
+        """
+        return a cheap fingerprint of the table's definition, which changes when its ddl does,
+        or None if the table doesn't exist
+        """
+        cur = self.cursor()
+        # any ddl rewrites the table's pg_class row (new xmin) or its storage (relfilenode)
+        cur.execute(
+            'select relfilenode, xmin from pg_class where oid = to_regclass(%s)', (table, )
+        )
+        res = cur.fetchone()
+        cur.close()
+        if res is None:
+            return None
+        return ':'.join(str(value) for value in res)
+
+    def get_hash_sql(self, column, data_type):
+        """
+        return an sql expression giving the md5 hex digest of a (large) column
+        """
+        if data_type in ['json', 'jsonb']:
+            # there's no md5(json), hash the text representation
+            return 'md5("{0}"::text)'.format(column)
+        return 'md5("{0}")'.format(column)
+
+    def get_load_sql(self, dump_file, table):
+        """
+        sql that can be run by the user to load the dump_file manually
+        """
+        return 'copy {0} from \'{1}\';'.format(table, dump_file)
+
+    def get_server_info(self):
+        """
+        return the version of the server we're connected to
+        """
+        return self.con.server_version
+
+    def ping(self):
+        """
+        return true if the connection is still usable
+        """
+        try:
+            cur = self.cursor()
+            cur.execute('select 1')
+            cur.close()
+            self.con.rollback()
+        except (self.driver.OperationalError, self.driver.InterfaceError):
+            return False
+        return True
+
+    def mogrify(self, sql, params):
+        """
+        return the statement (as bytes) that executing sql with params would run, without running it
+        """
+        cur = self.cursor()
+        ret = cur.mogrify(sql, params)
+        cur.close()
+        return ret
+
+    def load(self, dump_file, table):
+        """
+        load a dump file (COPY text format) into the given database + table, in a single COPY
+        """
+        # the dump is already in the connection's encoding, so it's copied as bytes
+        handle = open(dump_file, 'rb')
+        cur = self.cursor()
+        cur.copy_from(handle, table)
+        ret = self.affected_rows(cur)
+        cur.close()
+        handle.close()
+        return ret
@@ -0,0 +1,202 @@
+""" Opt-in tracing of every sql statement run through PDBC: latency, rows and result size """
+
+# standard imports
+import datetime
+import json
+import re
+import threading
+import time
+
+class SqlTracer(object):
+    """ SqlTracer constructor """
+
+    def __init__(self):
+        self.statements = []
+        # connections to several targets may be traced at once
+        self.lock = threading.Lock()
+
+    #
+    # PRIVATE methods
+    #
+
+    @classmethod
+    def _get_size(cls, rows):
+        """ return an estimate of the bytes in a list of fetched rows """
+        size = 0
+        for row in rows:
+            values = row.values() if isinstance(row, dict) else row
+            for value in values:
+                if isinstance(value, (bytes, bytearray, memoryview, str)):
+                    size += len(value)
+                elif value is not None:
+                    size += len(str(value))
+        return size
+
+    #
+    # PUBLIC methods
+    #
+
+    def fetched(self, statement, seconds, rows):
+        """
+        add rows fetched after a statement was executed to it
+
+        Keyword arguments:
+        statement -- as returned by record
+        seconds -- time spent fetching
+        rows -- the rows fetched
+        """
+        size = SqlTracer._get_size(rows)
+        with self.lock:
+            statement['seconds'] += seconds
+            statement['bytes'] += size
+
+    @classmethod
+    def normalize(cls, sql):
+        """
+        return sql with literals replaced by ?, so statements differing only by parameters
+        are reported together, e.g. where "id" in (1, 2, 3) becomes where "id" in (?)
+        """
+        if isinstance(sql, (bytes, bytearray)):
+            sql = bytes(sql).decode('UTF-8', 'replace')
+        sql = re.sub(r"'(?:[^'\\]|\\.|'')*'", '?', sql)
+        sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+        sql = sql.replace('%s', '?')
+        sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', sql)
+        # multi row inserts
+        sql = re.sub(r'\(\?\)(?:\s*,\s*\(\?\))+', '(?)', sql)
+        return re.sub(r'\s+', ' ', sql).strip()
+
+    def record(self, host_alias, sql, seconds, rows):
+        """
+        record a statement, returning it so rows fetched later can be added to it
+
+        Keyword arguments:
+        host_alias -- the host it was run on
+        sql -- the sql, as run
+        seconds -- time spent executing it
+        rows -- rows it returned or affected, if known
+        """
+        statement = {
+            'time': datetime.datetime.now().isoformat(),
+            'host': host_alias,
+            'sql': SqlTracer.normalize(sql),
+            'seconds': seconds,
+            'rows': rows if rows is not None and rows >= 0 else 0,
+            'bytes': 0
+        }
+        with self.lock:
+            self.statements.append(statement)
+        return statement
+
+    def summarise(self, top):
+        """
+        return the top slowest statements, by total time, grouped by host and normalized sql:
+            [{host, sql, calls, seconds, max_seconds, rows, bytes}]
+        """
+        grouped = {}
+        with self.lock:
+            for statement in self.statements:
+                group = grouped.setdefault((statement['host'], statement['sql']), {
+                    'host': statement['host'], 'sql': statement['sql'], 'calls': 0,
+                    'seconds': 0, 'max_seconds': 0, 'rows': 0, 'bytes': 0
+                })
+                group['calls'] += 1
+                group['seconds'] += statement['seconds']
+                group['max_seconds'] = max(group['max_seconds'], statement['seconds'])
+                group['rows'] += statement['rows']
+                group['bytes'] += statement['bytes']
+        return sorted(grouped.values(), key=lambda group: group['seconds'], reverse=True)[:top]
+
+    def wrap(self, cursor, host_alias):
+        """ return cursor wrapped so every statement run through it is recorded """
+        return TracedCursor(cursor, self, host_alias)
+
+    def write(self, trace_file):
+        """ append every statement recorded to trace_file as json lines """
+        with self.lock, open(trace_file, 'a') as handle:
+            for statement in self.statements:
+                handle.write(json.dumps(statement) + '\n')
+
+class TracedCursor(object):
+    """
+    cursor wrapper recording each statement executed through it with a SqlTracer,
+    anything else is passed straight through to the cursor
+    """
+
+    def __init__(self, cursor, tracer, host_alias):
+        self.cursor = cursor
+        self.tracer = tracer
+        self.host_alias = host_alias
+        self.statement = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        started = time.perf_counter()
+        for row in self.cursor:
+            if self.statement is not None:
+                self.tracer.fetched(self.statement, time.perf_counter() - started, [row])
+            yield row
+            started = time.perf_counter()
+
+    def _execute(self, method, sql, *args):
+        """ run a statement with method, recording it """
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            self.statement = self.tracer.record(
+                self.host_alias, sql, time.perf_counter() - started, self.cursor.rowcount
+            )
+
+    def _fetch(self, method, *args):
+        """ fetch a list of rows with method, adding them to the last statement """
+        started = time.perf_counter()
+        rows = method(*args)
+        if self.statement is not None:
+            self.tracer.fetched(self.statement, time.perf_counter() - started, rows)
+        return rows
+
+    def copy_expert(self, sql, handle, *args):
+        """ record a COPY statement, the bytes are those copied """
+        self._execute(self.cursor.copy_expert, sql, handle, *args)
+        if hasattr(handle, 'size'):
+            self.statement['bytes'] = handle.size
+
+    def copy_from(self, handle, table, *args, **kwargs):
+        """ record a COPY FROM STDIN """
+        started = time.perf_counter()
+        try:
+            return self.cursor.copy_from(handle, table, *args, **kwargs)
+        finally:
+            self.statement = self.tracer.record(
+                self.host_alias, 'copy "{0}" from stdin'.format(table),
+                time.perf_counter() - started, self.cursor.rowcount
+            )
+
+    def execute(self, sql, params=None):
+        """ record a statement """
+        return self._execute(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, params):
+        """ record a statement run for a list of params, as one statement """
+        return self._execute(self.cursor.executemany, sql, params)
+
+    def fetchall(self):
+        """ fetch every row, adding them to the last statement """
+        return self._fetch(self.cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        """ fetch some rows, adding them to the last statement """
+        if size is None:
+            return self._fetch(self.cursor.fetchmany)
+        return self._fetch(self.cursor.fetchmany, size)
+
+    def fetchone(self):
+        """ fetch a row, adding it to the last statement """
+        started = time.perf_counter()
+        row = self.cursor.fetchone()
+        if self.statement is not None and row is not None:
+            self.tracer.fetched(self.statement, time.perf_counter() - started, [row])
+        return row
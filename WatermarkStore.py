@@ -0,0 +1,76 @@
+""" High-water marks of incremental clones, kept per source, target and table """
+
+# standard imports
+import datetime
+import json
+import os
+import tempfile
+
+class WatermarkStore(object):
+    """ WatermarkStore constructor """
+
+    def __init__(self, directory):
+        """
+        Keyword arguments:
+        directory -- directory to keep watermark files in, created if it doesn't exist
+        """
+        self.directory = os.path.expanduser(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+
+    #
+    # PRIVATE methods
+    #
+
+    def _get_path(self, source_alias, target_alias, table):
+        """ return the path of the watermark file for a table cloned from source to target """
+        return os.path.join(self.directory, '{0}.{1}.{2}.json'.format(source_alias, target_alias, table))
+
+    #
+    # PUBLIC methods
+    #
+
+    def get(self, source_alias, target_alias, table, column):
+        """
+        return the high-water mark of the last successful clone of table from source to target,
+        or None if there hasn't been one (or it was taken on a different column)
+
+        Keyword arguments:
+        source_alias -- the configured alias of the source host
+        target_alias -- the configured alias of the target host
+        table -- the table
+        column -- the watermark column, e.g. last_updated
+        """
+        try:
+            with open(self._get_path(source_alias, target_alias, table)) as handle:
+                stored = json.load(handle)
+        except (IOError, ValueError):
+            return None
+        if stored['column'] != column:
+            return None
+        return stored['watermark']
+
+    def put(self, source_alias, target_alias, table, column, watermark):
+        """
+        store the high-water mark of a successful clone of table from source to target
+
+        Keyword arguments:
+        source_alias -- the configured alias of the source host
+        target_alias -- the configured alias of the target host
+        table -- the table
+        column -- the watermark column, e.g. last_updated
+        watermark -- the highest value of column cloned
+        """
+        # timestamps are stored as the literal the database gave us, numbers as they are
+        if not isinstance(watermark, (int, float)):
+            watermark = str(watermark)
+        stored = {
+            'column': column,
+            'watermark': watermark,
+            'time': datetime.datetime.now().isoformat()
+        }
+        # write and rename, so a run that dies half way never leaves half a file
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as tmp_file:
+            json.dump(stored, tmp_file)
+        os.replace(tmp_path, self._get_path(source_alias, target_alias, table))